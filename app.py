@@ -1,102 +1,162 @@
-import json
+import sqlite3
 import sys
 from datetime import datetime, timedelta
 from pathlib import Path
+from threading import RLock
 
-from numpy import isnan
-from pandas import DataFrame, concat, read_excel, to_datetime
-from PySide6.QtCore import QAbstractTableModel, QDate, Qt
+from pandas import NaT, DataFrame, concat, isna, to_datetime
+from PySide6.QtCore import (QAbstractTableModel, QDate, QModelIndex, QObject,
+                            QRunnable, Qt, QThread, QThreadPool, QTimer,
+                            Signal)
+from PySide6.QtGui import QKeySequence, QShortcut
 from PySide6.QtWidgets import (QAbstractItemView, QApplication, QCheckBox,
                                QDateEdit, QDialog, QFileDialog, QHBoxLayout,
                                QHeaderView, QLabel, QLineEdit, QMessageBox,
-                               QPushButton, QTableView, QVBoxLayout, QWidget, QComboBox)
-
-def load_excel_data():
-    df = read_excel(f'bin/{datetime.now().year}{datetime.now().month:02d}.xlsx',
-                    dtype={
-                        'pid': int,
-                        'Serial_Number': str,
-                        'Box': int,
-                        'Cell': int,
-                        # 'Place_Date': datetime,
-                        'Report_Generated': bool,
-                        # 'Takeout_Date': datetime
-                    }
-                    )
-    df = df.loc[df['Serial_Number'] != "init",].copy().reset_index(drop=True)
-    return df
-
-def init_excel_data():
-    last_month = datetime.now().replace(day=1) - timedelta(days=1)
-    if Path(f'bin/{last_month.year}{last_month.month:02d}.xlsx').exists():
-        data = read_excel(Path(f'bin/{last_month.year}{last_month.month:02d}.xlsx'))
-        data = data.loc[data['Takeout_Date'].isna(), ].copy().reset_index(drop=True)
-    else:
-        data = DataFrame({'pid': 0, 'Serial_Number': 'init',  'Box': 0,  'Cell': 0, 
-                        'Place_Date': to_datetime("1970-01-01 00:00:00"), 'Report_Generated': True, 'Takeout_Date': to_datetime("1970-01-01 00:00:00")}, 
-                        index=[0])
-    if data.shape[0] == 0:
-        data = DataFrame({'pid': 0, 'Serial_Number': 'init',  'Box': 0,  'Cell': 0, 
-                        'Place_Date': to_datetime("1970-01-01 00:00:00"), 'Report_Generated': True, 'Takeout_Date': to_datetime("1970-01-01 00:00:00")}, 
-                        index=[0])
-    data.to_excel(f'bin/{datetime.now().year}{datetime.now().month:02d}.xlsx', index=False)
-
-def load_settings():
-    with open('bin/settings.json', 'r') as f:
-        data = json.load(f)
-        box_amount = data['box_amount']
-        cell_amount = data['cell_amount']
-        empty_string = str(data['empty_string'])
-        full_string = str(data['full_string'])
-    return box_amount, cell_amount, empty_string, full_string
+                               QPlainTextEdit, QPushButton, QTableView, QVBoxLayout, QWidget, QComboBox)
+
+from core import instrument
+from core.allocator import initBoxStatus
+from core.report import write_report
+from core.search import initSerialIndex, parse_serials
+from core.service import ServiceClient, ServiceError
+from core.settings import load_settings
+from core.store import (COLUMNS, SqliteStore, batch_rows, init_excel_data,
+                        compact_frame, db_date, item_frame, load_excel_data, month_list,
+                        month_start)
+
+class StoreWriter(QObject):
+    # Runs store writes on a single pool thread. Writes submitted while one
+    # is in flight are queued and go out together in the next transaction.
+    # A transaction that fails is kept as (message, batch) until the window
+    # takes it with take_failures(); failed says there is one.
+    state_changed = Signal()
+    failed = Signal()
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.lock = RLock()
+        self.pending = []
+        self.running = False
+        self.failures = []
+
+    def submit(self, kind, df):
+        with self.lock:
+            self.pending.append((kind, batch_rows(kind, df)))
+            if self.running:
+                return
+            self.running = True
+        self.state_changed.emit()
+        self.pool.start(StoreWriteTask(self))
+
+    def is_busy(self):
+        with self.lock:
+            return self.running
+
+    def flush(self):
+        done = False
+        try:
+            while True:
+                with self.lock:
+                    batch, self.pending = self.pending, []
+                    if not batch:
+                        self.running = False
+                        done = True
+                        break
+                try:
+                    missing = self.store.write_batch(batch)
+                    if missing:
+                        # Saved scans the store service no longer had (another
+                        # window reclaimed them); the window scans them again.
+                        self.fail('', [('missing', [(pid,) for pid in missing])])
+                except (sqlite3.Error, OSError, ServiceError) as e:
+                    self.fail(str(e), batch)
+                except Exception as e:
+                    # A bad service reply or a bug: still hand the batch back.
+                    self.fail(f'{type(e).__name__}: {e}', batch)
+        finally:
+            if not done:
+                with self.lock:
+                    self.running = False
+            self.state_changed.emit()
+
+    def fail(self, message, batch):
+        with self.lock:
+            self.failures.append((message, batch))
+        self.failed.emit()
+
+    def take_failures(self):
+        with self.lock:
+            failures, self.failures = self.failures, []
+        return failures
+
+    def wait(self):
+        self.pool.waitForDone()
+
+class StoreWriteTask(QRunnable):
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def run(self):
+        self.writer.flush()
+
 
 def chunk(list, n):
     for i in range(0, len(list), n):
         yield list[i:i+n]
 
-def initBoxStatus(df, box_amount, cell_amount):
-    df = df.loc[df['Takeout_Date'].isna()]
-    box_status = [i for i in (empty_string * box_amount * cell_amount)]
-    for _, row in df.iterrows():
-        box_status[((row['Box'] - 1) * cell_amount) + (row['Cell']) - 1] = full_string
-    return box_status
-
-def insert_to_empty_cell(box_status, pattern, replacement):
-    pattern = str(pattern)
-    replacement = str(replacement)
-    if pattern not in box_status:
-        return "full"
-    if replacement in box_status:
-        from_beginning = False
-        if not from_beginning:
-            last_occur = len(box_status) - 1 - box_status[::-1].index(replacement)
-            if last_occur == len(box_status) - 1:
-                from_beginning = True
-            else:
-                i = last_occur + 1
-                box_status[i] = replacement
-        if from_beginning:
-            i = box_status.index(pattern)
-            box_status[i] = replacement
-    else:
-        i = 0
-        box_status[i] = replacement
-    return i + 1
-
-
 def get_today():
     today = datetime.now()
     return {'year': today.year, 'month': today.month, 'day': today.day}
 
 
 class MainWindow(QWidget):
-    def __init__(self):
+    def __init__(self, store, writer, settings, client=None):
         super().__init__()
-        self.dataframe = load_excel_data()
-        self.box_status = initBoxStatus(self.dataframe, box_amount, cell_amount)
+        self.store = store
+        self.writer = writer
+        self.settings = settings
+        # With a store service, cells are handed out and writes committed
+        # by the service, and store is the client too: the station never
+        # opens the store file.
+        self.client = client
+        self.feed = client or store
+        if client:
+            # Scans this station left unsaved last time (a crash, a kill)
+            # give their cells back.
+            client.reclaim()
+        self.dataframe = None
+        self.load_data()
+        self.next_pid = max(int(self.dataframe['pid'].max()) if self.dataframe.shape[0] else 0, store.last_pid()) + 1
         self.today = get_today()
+        self.month = month_start()
+        # A session left open over the end of a month rolls over on its own.
+        self.rollover_timer = QTimer(self)
+        self.rollover_timer.timeout.connect(self.check_rollover)
+        self.rollover_timer.start(60 * 1000)
+        # Other stations' saves and takeouts arrive through the change feed.
+        self.feed_timer = QTimer(self)
+        self.feed_timer.timeout.connect(self.poll_changes)
+        self.feed_timer.start(2 * 1000)
         self.initializeUI()
 
+    def load_data(self):
+        # The month view from the store plus this window's unsaved rows.
+        # Unconfirmed rows of other stations only take up their cells.
+        self.change_seq = self.feed.last_change()
+        loaded = load_excel_data(self.store)
+        unsaved = loaded.iloc[0:0]
+        if self.dataframe is not None:
+            unsaved = self.unsaved_rows()
+        occupied = concat([loaded, unsaved.loc[~unsaved.index.isin(loaded.index)]], axis=0)
+        self.box_status = initBoxStatus(occupied, self.settings.box_amount, self.settings.cell_amount,
+                                        self.settings.allocation, self.settings.reserved_boxes)
+        self.dataframe = concat([loaded.loc[loaded['Report_Generated']], unsaved], axis=0)
+        self.serial_index = initSerialIndex(self.dataframe)
+
 
     def initializeUI(self):
         self.setFixedSize(800, 600)
@@ -121,6 +181,8 @@ class MainWindow(QWidget):
         self.sn.returnPressed.connect(self.insert_new_item)
         add_new_item_button = QPushButton("Add item")        
         add_new_item_button.clicked.connect(self.insert_new_item)
+        bulk_add_button = QPushButton("Bulk add")
+        bulk_add_button.clicked.connect(self.bulk_add)
         takeout_button = QPushButton("Search item")
         takeout_button.clicked.connect(self.takeout_item)
         report_generate_button = QPushButton("Report Generate")
@@ -128,6 +190,7 @@ class MainWindow(QWidget):
 
         search_sn_label = QLabel("[SEARCH] SN:", self)
         self.search_sn = QLineEdit(self)
+        self.search_sn.returnPressed.connect(self.takeout_item)
         self.year_input = QComboBox(self)
         self.year_input.addItems([str(item) for item in list(range(2020,datetime.now().year+1))])
         self.year_input.setCurrentText(str(self.today['year']))
@@ -136,14 +199,22 @@ class MainWindow(QWidget):
         self.month_input.setCurrentText(str(self.today['month']))
         # self.date_input = QDateEdit(calendarPopup=True)
         # self.date_input.setDate(QDate.fromString(datetime.now().strftime("%Y-%m"), "yyyy-MM"))
+        self.contains_checkbox = QCheckBox("Contains")
         self.date_checkbox = QCheckBox("Date:")
 
         save_button = QPushButton("Save")
         save_button.clicked.connect(lambda: self.save_data(show_box=True))
+        self.save_status = QLabel("", self)
+        self.writer.state_changed.connect(self.show_save_status)
+        self.writer.failed.connect(self.write_failed)
 
         delete_row_button = QPushButton("Delete")
         delete_row_button.clicked.connect(self.delete_row)
 
+        if instrument.enabled:
+            profile_shortcut = QShortcut(QKeySequence("Ctrl+Shift+P"), self)
+            profile_shortcut.activated.connect(self.toggle_profile)
+
         # layouts
         button_box = QVBoxLayout()
 
@@ -151,10 +222,12 @@ class MainWindow(QWidget):
         add_item_box.addWidget(sn_label)
         add_item_box.addWidget(self.sn)
         add_item_box.addWidget(add_new_item_button)
+        add_item_box.addWidget(bulk_add_button)
 
         search_box = QHBoxLayout()
         search_box.addWidget(search_sn_label)
         search_box.addWidget(self.search_sn)
+        search_box.addWidget(self.contains_checkbox)
         search_box.addWidget(self.date_checkbox)
         search_box.addWidget(self.year_input)
         search_box.addWidget(self.month_input)
@@ -173,11 +246,12 @@ class MainWindow(QWidget):
         main_v_box.addWidget(delete_row_button)
         main_v_box.addLayout(button_box)
         main_v_box.addWidget(save_button)
+        main_v_box.addWidget(self.save_status)
 
         self.setLayout(main_v_box)
 
     def initTable(self):
-        self.model = TableModel(self.dataframe.query('Report_Generated == False').copy().reset_index(drop=True))
+        self.model = TableModel(self.unsaved_rows())
 
         # Table Init
         self.table = QTableView()
@@ -191,6 +265,10 @@ class MainWindow(QWidget):
         for column in [0, 6, 7]:
             self.table.hideColumn(column)
 
+    def unsaved_rows(self):
+        # Rows scanned in this window and not saved yet; what the table shows.
+        return self.dataframe.loc[self.dataframe['Report_Generated'] == False]
+
     def insert_new_item(self):
         sn_text = self.sn.text()
 
@@ -205,9 +283,14 @@ class MainWindow(QWidget):
 
 
         if sn_text:
-            insert_result = insert_to_empty_cell(self.box_status, empty_string, full_string)
+            try:
+                added, _ = self.insert_items([sn_text])
+            except (OSError, ServiceError) as e:
+                # The scan stays in the box to try again.
+                self.show_service_error(str(e))
+                return
 
-            if insert_result == 'full':
+            if not added:
                 error_msg = QMessageBox()
                 error_msg.setIcon(QMessageBox.Icon.Critical)
                 error_msg.setText("All Box Full")
@@ -216,32 +299,157 @@ class MainWindow(QWidget):
                 self.sn.setText('')
                 return
 
+            self.sn.setText(None)
 
-            cell = insert_result % cell_amount
-
-            if cell == 0:
-                cell = cell_amount
-                box = insert_result // cell_amount
-            else:
-                box = insert_result // cell_amount + 1
-            
-            last_pid = self.dataframe['pid'].max()
-            if isnan(last_pid):
-                last_pid = 0
-            new_df = DataFrame({
-                'pid': (last_pid + 1),
-                'Serial_Number': sn_text,
-                'Box': box,
-                'Cell': cell,
+    @instrument.timed('MainWindow.insert_items', rows=lambda result: len(result[0]))
+    def insert_items(self, serials):
+        # Returns (added, rejected); items past the last free cell are rejected.
+        # A store service that cannot be reached raises OSError/ServiceError.
+        if self.client:
+            rows, rejected = self.client.add(serials)
+            new_df = item_frame(rows)
+            for box, cell in zip(new_df['Box'], new_df['Cell']):
+                self.box_status.occupy(box, cell)
+        else:
+            positions = self.box_status.allocate_many(len(serials), serials)
+            pids = list(range(self.next_pid, self.next_pid + len(positions)))
+            self.next_pid += len(positions)
+            rejected = serials[len(positions):]
+            new_df = compact_frame(DataFrame({
+                'pid': pids,
+                'Serial_Number': serials[:len(positions)],
+                'Box': [box for box, _ in positions],
+                'Cell': [cell for _, cell in positions],
                 'Place_Date': datetime.now().replace(microsecond=0),
                 'Report_Generated': False,
-                'Takeout_Date': None}, index=[0])
-            self.dataframe = concat([self.dataframe, new_df], axis=0, ignore_index=True)
-            self.model = TableModel(self.dataframe.query("Report_Generated == False").copy().reset_index(drop=True))
-            self.table.setModel(self.model)
-            self.box_status = initBoxStatus(self.dataframe[self.dataframe['Takeout_Date'].isna()].copy().reset_index(drop=True), box_amount, cell_amount)
-            self.sn.setText(None)
-            self.table.scrollToBottom()
+                'Takeout_Date': None}, index=pids))
+        added = new_df['Serial_Number'].tolist()
+        pids = new_df['pid'].tolist()
+        if not added:
+            return added, rejected
+        self.dataframe = concat([self.dataframe, new_df], axis=0)
+        self.model.appendRows(new_df)
+        if len(added) == 1:
+            self.serial_index.add(added[0], pids[0])
+        else:
+            self.serial_index.add_many(added, pids)
+        self.table.scrollToBottom()
+        return added, rejected
+
+    def bulk_add(self):
+        bulk_window = BulkAddWindow(self)
+        bulk_window.exec()
+
+    def toggle_profile(self):
+        path = instrument.toggle_profile()
+        QMessageBox.information(
+            self,
+            'Profile',
+            f"Profile saved to {path}" if path else "Profiling started. Press Ctrl+Shift+P again to stop.",
+            QMessageBox.StandardButton.Ok,
+            QMessageBox.StandardButton.Ok
+        )
+
+    def show_save_status(self):
+        self.save_status.setText("Saving..." if self.writer.is_busy() else "Saved")
+
+    def show_save_error(self, message):
+        error_msg = QMessageBox()
+        error_msg.setIcon(QMessageBox.Icon.Critical)
+        error_msg.setText(f"Save failed: {message}")
+        error_msg.setWindowTitle("Save failed")
+        error_msg.exec()
+
+    def write_failed(self):
+        # Returns True when a write had failed; closeEvent calls it directly
+        # because the failed signal is only delivered after it returns.
+        failures = self.writer.take_failures()
+        for _, batch in failures:
+            self.restore_batch(batch)
+        messages = [message for message, _ in failures if message]
+        if messages:
+            self.show_save_error('\n'.join(messages))
+        return bool(failures)
+
+    def restore_batch(self, batch):
+        # A failed transaction wrote nothing: its scans go back to the table
+        # unsaved and its takeouts back to open, so the next Save sends
+        # them again.
+        df = self.dataframe
+        scanned = [row[0] for kind, rows in batch if kind in ('add', 'confirm') for row in rows if row[0] in df.index]
+        taken = [row[1] for kind, rows in batch if kind == 'takeout' for row in rows if row[1] in df.index]
+        missing = [row[0] for kind, rows in batch if kind == 'missing' for row in rows if row[0] in df.index]
+        if scanned:
+            df.loc[scanned, 'Report_Generated'] = False
+            if not self.client:
+                self.renumber(scanned)
+        for pid in taken:
+            row = self.dataframe.loc[pid]
+            if not isna(row['Takeout_Date']):
+                self.dataframe.loc[pid, 'Takeout_Date'] = NaT
+                self.box_status.occupy(row['Box'], row['Cell'])
+                self.serial_index.add(str(row['Serial_Number']), pid)
+        if missing:
+            self.rescan(missing)
+        self.model.setDataFrame(self.unsaved_rows())
+
+    def rescan(self, pids):
+        # Another window reclaimed these scans, so their rows and cells are
+        # gone from the store; the same serials are added again and the
+        # items have to move to their new cells.
+        rows = self.dataframe.loc[pids]
+        serials = rows['Serial_Number'].astype(str).tolist()
+        old_cells = dict(zip(serials, zip(rows['Box'], rows['Cell'])))
+        for pid, serial, box, cell in zip(pids, serials, rows['Box'], rows['Cell']):
+            self.box_status.release(box, cell)
+            self.serial_index.remove(serial, pid)
+        self.dataframe = self.dataframe.drop(index=pids)
+        self.model.removePids(pids)
+        try:
+            added, lost = self.insert_items(serials)
+        except (OSError, ServiceError):
+            added, lost = [], serials
+        new_rows = self.dataframe.tail(len(added))
+        lines = [f"{serial}: Box {box} Cell {cell}"
+                 for serial, box, cell in zip(added, new_rows['Box'], new_rows['Cell'])
+                 if old_cells[serial] != (box, cell)]
+        if lost:
+            lines.append(f"Scan these again: {', '.join(lost)}")
+        if not lines:
+            return
+        error_msg = QMessageBox()
+        error_msg.setIcon(QMessageBox.Icon.Warning)
+        error_msg.setText("Another window took these scans back; move them to their new cells:\n" + '\n'.join(lines))
+        error_msg.setWindowTitle("Scans moved")
+        error_msg.exec()
+
+    def renumber(self, pids):
+        # Another writer may have used these pids in the meantime (the
+        # failure is then a UNIQUE constraint); move them past the store's
+        # last pid.
+        others = self.store.items(pids)
+        used = sorted(row[0] for row in others)
+        if not used:
+            return
+        self.next_pid = max(self.next_pid, self.store.last_pid() + 1)
+        renamed = {pid: self.next_pid + i for i, pid in enumerate(used)}
+        self.next_pid += len(renamed)
+        for pid, new_pid in renamed.items():
+            serial = str(self.dataframe.at[pid, 'Serial_Number'])
+            self.serial_index.remove(serial, pid)
+            self.serial_index.add(serial, new_pid)
+        self.dataframe = self.dataframe.rename(index=renamed)
+        self.dataframe['pid'] = self.dataframe.index.to_numpy()
+        # The rows that took the pids belong in the view like any other
+        # station's.
+        self.apply_changes([(None, 'add', row[0], row) for row in others])
+
+    def show_service_error(self, message):
+        error_msg = QMessageBox()
+        error_msg.setIcon(QMessageBox.Icon.Critical)
+        error_msg.setText(f"Store service error, nothing was added: {message}")
+        error_msg.setWindowTitle("Store service")
+        error_msg.exec()
 
     def closeEvent(self, event):
         answer = QMessageBox.question(self, "Quit?",
@@ -252,48 +460,67 @@ class MainWindow(QWidget):
                                       QMessageBox.StandardButton.Yes)
         if answer == QMessageBox.StandardButton.Yes:
             self.save_data(show_box=False)
+            self.writer.wait()
+            if self.write_failed():
+                event.ignore()
+                return
+            self.close_month()
             event.accept()
         if answer == QMessageBox.StandardButton.No:
+            if self.client:
+                # Give back the cells the service reserved for unsaved scans.
+                self.writer.submit('delete', self.unsaved_rows())
+            self.writer.wait()
+            if self.write_failed():
+                event.ignore()
+                return
+            self.close_month()
             event.accept()
         if answer == QMessageBox.StandardButton.Cancel:
             event.ignore()
 
+    def close_month(self):
+        # The service exports on its own when it stops.
+        if self.client:
+            return
+        self.check_rollover()
+        self.store.export_month()
+
+    def check_rollover(self):
+        month = month_start()
+        if month > self.month:
+            self.rollover(month)
+
+    @instrument.timed('MainWindow.rollover')
+    def rollover(self, month):
+        # Pending writes belong to the month being closed.
+        self.writer.wait()
+        if not self.client:
+            self.store.rollover(month)
+        self.month = month
+        self.today = get_today()
+        # Items taken out before the new month drop out of the month view;
+        # open items, the allocator and the serial index stay as they are.
+        takeout_date = self.dataframe['Takeout_Date']
+        self.dataframe = self.dataframe.loc[takeout_date.isna() | (takeout_date >= month)]
+        if self.year_input.findText(str(month.year)) < 0:
+            self.year_input.addItem(str(month.year))
+
     def takeout_item(self):
-        #(取消) 增加搜尋之前月份的功能
         search_sn = None
         search_date = None
 
-        if not self.date_checkbox.isChecked() and not self.search_sn.text():
-            error_msg = QMessageBox()
-            error_msg.setIcon(QMessageBox.Icon.Critical)
-            error_msg.setText("Please SET Search Condition.")
-            error_msg.setWindowTitle("SET Search Condition")
-            error_msg.exec()
-            return
-
         if self.search_sn.text():
             search_sn = self.search_sn.text()
+        search_mode = 'substring' if self.contains_checkbox.isChecked() else 'prefix'
 
         if not self.date_checkbox.isChecked():
-            search_window = TakeoutitemWindow(self.dataframe, search_sn, search_date)
+            search_window = TakeoutitemWindow(self, search_sn, search_date, search_mode)
         elif self.date_checkbox.isChecked():
-            search_window = TakeoutitemWindow(self.dataframe, search_sn, search_date)
-        # else:
-        #     previous_excel = read_excel(
-        #         f'bin/{self.year_input.currentText()}{self.month_input.currentText().zfill(2)}.xlsx',
-        #         dtype={
-        #                 'pid': int,
-        #                 'Serial_Number': str,
-        #                 'Box': int,
-        #                 'Cell': int,
-        #                 'Place_Date': datetime,
-        #                 'Report_Generated': bool,
-        #                 'Takeout_Date': datetime
-        #             }
-        #     )
-        #     search_window = TakeoutitemWindow(previous_excel, search_sn, search_date)
+            search_from = datetime(int(self.year_input.currentText()), int(self.month_input.currentText()), 1)
+            search_window = HistorySearchWindow(self.store, search_sn, month_list(search_from), search_mode)
         search_window.exec()
-        self.update_data_model(update_model=True)
+        self.update_data_model(update_model=False)
 
 
     def report_generate(self):
@@ -310,18 +537,22 @@ class MainWindow(QWidget):
         if answer == QMessageBox.StandardButton.Yes:
             self.save_data(show_box=False)
         
-        report_window = GenerateReportWindow(self.dataframe)
+        # Reports read the store, so pending writes have to land first.
+        self.writer.wait()
+        report_window = GenerateReportWindow(self.store, self.settings)
         report_window.exec()
 
-        self.update_data_model(update_model=True)
+        self.update_data_model(update_model=False)
 
 
 
+    @instrument.timed('MainWindow.save_data')
     def save_data(self, show_box):
         # date = self.date_input.date().toString("yyyy-MM-dd")
         # self.dataframe.loc[self.dataframe['Place_Date'].dt.strftime('%Y-%m-%d') == date, 'Report_Generated'] = True
-        self.dataframe.loc[self.dataframe['Report_Generated'] == False, 'Report_Generated'] = True
-        self.dataframe.to_excel(f'bin/{datetime.now().year}{datetime.now().month:02d}.xlsx', index=False)
+        unsaved = self.dataframe['Report_Generated'] == False
+        self.dataframe.loc[unsaved, 'Report_Generated'] = True
+        self.writer.submit('confirm' if self.client else 'add', self.dataframe.loc[unsaved])
         if show_box:
             QMessageBox.information(
                 self,
@@ -337,27 +568,105 @@ class MainWindow(QWidget):
         indices = self.table.selectionModel().selectedRows()
         for index in sorted(indices):
             pid_list.append(int(self.table.model().index(index.row(), 0).data()))
-        for i in pid_list:
-            box = self.dataframe.loc[self.dataframe['pid']== i, 'Box'].values[0]
-            cell = self.dataframe.loc[self.dataframe['pid'] == i, 'Cell'].values[0]
-            cell_pos = ((box -1) * cell_amount) + (cell - 1)
-            self.box_status[cell_pos] = empty_string
-        self.dataframe = self.dataframe.loc[~self.dataframe['pid'].isin(pid_list), ].copy().reset_index(drop=True)
-        self.model = TableModel(self.dataframe.query("Report_Generated == False").copy().reset_index(drop=True))
-        self.table.setModel(self.model)
-
+        deleted = self.dataframe.loc[pid_list]
+        for pid, serial, box, cell in zip(pid_list, deleted['Serial_Number'], deleted['Box'], deleted['Cell']):
+            self.box_status.release(box, cell)
+            self.serial_index.remove(str(serial), pid)
+        self.dataframe = self.dataframe.drop(index=pid_list)
+        self.model.removePids(pid_list)
+        if self.client:
+            self.writer.submit('delete', deleted)
+
+    @instrument.timed('MainWindow.update_data_model')
     def update_data_model(self, update_model):
-        self.dataframe = load_excel_data()
-        self.box_status = initBoxStatus(self.dataframe, box_amount, cell_amount)
+        # Every action already keeps self.dataframe current; only what other
+        # stations did since the last look is read, from the change feed.
+        if self.poll_changes():
+            update_model = True
         if update_model:
-            self.model = TableModel(self.dataframe.query("Report_Generated == False").copy().reset_index(drop=True))
-            self.table.setModel(self.model)
-        pass
+            self.model.setDataFrame(self.unsaved_rows())
+
+    def poll_changes(self):
+        # Returns True when the feed had moved on too far and everything
+        # was loaded again.
+        try:
+            changes = self.feed.changes(self.change_seq)
+        except (sqlite3.Error, OSError, ServiceError):
+            return False
+        if changes is None:
+            self.load_data()
+            self.next_pid = max(self.next_pid, self.store.last_pid() + 1)
+            return True
+        if changes:
+            self.change_seq = changes[-1][0]
+            self.apply_changes(changes)
+        return False
+
+    @instrument.timed('MainWindow.apply_changes')
+    def apply_changes(self, changes):
+        # Changes made by this window come back too and change nothing.
+        latest = {pid: item for _, _, pid, item in changes}
+        month = db_date(self.month)
+        added = []
+        reclaimed = []
+        moved_unsaved = False
+        for pid, item in latest.items():
+            known = pid in self.dataframe.index
+            if item is None:
+                if known and self.client and isna(self.dataframe.at[pid, 'Takeout_Date']):
+                    # The service only deletes unsaved scans, so another
+                    # window has reclaimed one of ours.
+                    reclaimed.append(pid)
+                elif known:
+                    row = self.dataframe.loc[pid]
+                    if isna(row['Takeout_Date']):
+                        self.box_status.release(row['Box'], row['Cell'])
+                        self.serial_index.remove(str(row['Serial_Number']), pid)
+                    self.dataframe = self.dataframe.drop(index=[pid])
+                    self.model.removePids([pid])
+                continue
+            _, serial, box, cell, _, confirmed, takeout_date = item
+            if not known:
+                if not confirmed:
+                    # Another station's scan, not saved yet.
+                    if takeout_date is None:
+                        self.box_status.occupy(box, cell)
+                elif takeout_date is None or takeout_date >= month:
+                    added.append(item)
+                continue
+            if str(self.dataframe.at[pid, 'Serial_Number']) != serial:
+                # Another writer took this window's pid; renumber() sorts it
+                # out when the save fails.
+                continue
+            # Moved by a compaction.
+            old_box, old_cell = self.dataframe.at[pid, 'Box'], self.dataframe.at[pid, 'Cell']
+            if (old_box, old_cell) != (box, cell):
+                if isna(self.dataframe.at[pid, 'Takeout_Date']):
+                    self.box_status.move((old_box, old_cell), (box, cell))
+                self.dataframe.loc[pid, ['Box', 'Cell']] = [box, cell]
+                moved_unsaved = moved_unsaved or not self.dataframe.at[pid, 'Report_Generated']
+            if takeout_date is not None and isna(self.dataframe.at[pid, 'Takeout_Date']):
+                self.dataframe.loc[pid, 'Takeout_Date'] = to_datetime(takeout_date)
+                self.box_status.release(box, cell)
+                self.serial_index.remove(str(serial), pid)
+        if added:
+            new_df = item_frame(added)
+            self.dataframe = concat([self.dataframe, new_df], axis=0)
+            still_open = new_df.loc[new_df['Takeout_Date'].isna()]
+            for box, cell in zip(still_open['Box'], still_open['Cell']):
+                self.box_status.occupy(box, cell)
+            self.serial_index.add_many(still_open['Serial_Number'].astype(str).tolist(), still_open['pid'].tolist())
+            self.next_pid = max(self.next_pid, int(new_df['pid'].max()) + 1)
+        if reclaimed:
+            self.rescan(reclaimed)
+        if moved_unsaved or reclaimed:
+            self.model.setDataFrame(self.unsaved_rows())
 
 class GenerateReportWindow(QDialog):
-    def __init__(self, df):
+    def __init__(self, store, settings):
         super().__init__()
-        self.dataframe = df
+        self.store = store
+        self.settings = settings
         self.initializeUI()
 
     def initializeUI(self):
@@ -366,8 +675,16 @@ class GenerateReportWindow(QDialog):
         self.setUpWindow()
 
     def setUpWindow(self):
+        today = QDate.fromString(datetime.now().strftime("%Y-%m-%d"), "yyyy-MM-dd")
         self.date_input = QDateEdit(calendarPopup=True)
-        self.date_input.setDate(QDate.fromString(datetime.now().strftime("%Y-%m-%d"), "yyyy-MM-dd"))
+        self.date_input.setDate(today)
+        self.end_date_input = QDateEdit(calendarPopup=True)
+        self.end_date_input.setDate(today)
+        date_box = QHBoxLayout()
+        date_box.addWidget(QLabel("From"))
+        date_box.addWidget(self.date_input)
+        date_box.addWidget(QLabel("To"))
+        date_box.addWidget(self.end_date_input)
 
         close_button = QPushButton("Close")
         close_button.clicked.connect(lambda: self.close())
@@ -375,21 +692,22 @@ class GenerateReportWindow(QDialog):
         generate_button.clicked.connect(self.generate_report)
 
         main_box = QVBoxLayout()
-        main_box.addWidget(self.date_input)
+        main_box.addLayout(date_box)
         main_box.addWidget(generate_button)
         main_box.addWidget(close_button)
 
         self.setLayout(main_box)
 
     def generate_report(self):
-        name, _ = QFileDialog.getSaveFileName(self, 'Save File', f"{self.date_input.date().toString('yyyyMMdd')}_.xlsx", "Excel Files (*.xlsx)")
+        start = self.date_input.date()
+        end = self.end_date_input.date()
+        if end < start:
+            start, end = end, start
+        default_name = start.toString('yyyyMMdd') if start == end else f"{start.toString('yyyyMMdd')}-{end.toString('yyyyMMdd')}"
+        name, _ = QFileDialog.getSaveFileName(self, 'Save File', f"{default_name}_.xlsx", "Excel Files (*.xlsx);;CSV Files (*.csv)")
         if not name:
             return
-        date = self.date_input.date().toString("yyyy-MM-dd")
-        # self.dataframe.loc[self.dataframe['Place_Date'].dt.strftime('%Y-%m-%d') == date, 'Report_Generated'] = True
-        query_data = self.dataframe[self.dataframe['Place_Date'].dt.strftime('%Y-%m-%d') == date]
-        query_data.to_excel(name, index = False)
-        self.dataframe.to_excel(f'bin/{datetime.now().year}{datetime.now().month:02d}.xlsx', index=False)
+        write_report(self.store, self.settings, name, start.toPython(), end.toPython())
         QMessageBox.information(
             self,
             'Message',
@@ -398,26 +716,103 @@ class GenerateReportWindow(QDialog):
             QMessageBox.StandardButton.Ok
         )
 
-class TakeoutitemWindow(QDialog):
-    def __init__(self, df, sn=None, date=None):
+class BulkAddWindow(QDialog):
+    def __init__(self, main_window):
         super().__init__()
-        self.dataframe = df
-        self.prepared_df = (df
-            .query(f'Takeout_Date == "" | Takeout_Date.isna()')
-            .query(f'Report_Generated == True')
+        self.main_window = main_window
+        self.initializeUI()
+
+    def initializeUI(self):
+        self.setFixedSize(400, 480)
+        self.setWindowTitle("Bulk add")
+        self.setUpWindow()
+
+    def setUpWindow(self):
+        label = QLabel("One Serial Number per line (scan or paste):", self)
+        self.serials_input = QPlainTextEdit(self)
+
+        load_button = QPushButton("Load file")
+        load_button.clicked.connect(self.load_file)
+        add_button = QPushButton("Add")
+        add_button.clicked.connect(self.add_items)
+        close_button = QPushButton("Close")
+        close_button.clicked.connect(lambda: self.close())
+
+        button_box = QHBoxLayout()
+        button_box.addWidget(load_button)
+        button_box.addWidget(add_button)
+
+        main_box = QVBoxLayout()
+        main_box.addWidget(label)
+        main_box.addWidget(self.serials_input)
+        main_box.addLayout(button_box)
+        main_box.addWidget(close_button)
+
+        self.setLayout(main_box)
+
+    def load_file(self):
+        name, _ = QFileDialog.getOpenFileName(self, 'Open File', '', "CSV or Text Files (*.csv *.txt)")
+        if not name:
+            return
+        with open(name, 'r', encoding='utf-8-sig', newline='') as f:
+            self.serials_input.setPlainText(f.read())
+
+    def add_items(self):
+        serials = parse_serials(self.serials_input.toPlainText())
+        if not serials:
+            return
+        try:
+            added, rejected = self.main_window.insert_items(serials)
+        except (OSError, ServiceError) as e:
+            self.main_window.show_service_error(str(e))
+            return
+        # Leave only what did not fit, so it can be added once cells free up.
+        self.serials_input.setPlainText('\n'.join(rejected))
+        message = f"{len(added)} items added."
+        if rejected:
+            message += f"\nAll Box Full: {len(rejected)} items rejected, starting at {rejected[0]}."
+        QMessageBox.information(
+            self,
+            'Message',
+            message,
+            QMessageBox.StandardButton.Ok,
+            QMessageBox.StandardButton.Ok
         )
-        
-        if sn:
-            self.prepared_df = self.prepared_df[self.prepared_df['Serial_Number'].str.match(sn)].copy().reset_index(drop=True)
-        if date:
-            self.date = date
-            self.prepared_df = self.prepared_df[self.prepared_df['Place_Date'].dt.strftime('%Y-%m-%d') == self.date.strftime('%Y-%m-%d')].copy().reset_index(drop=True)
-        self.model = TableModel(self.prepared_df)
+
+class HistorySearchThread(QThread):
+    month_found = Signal(object, object)
+
+    def __init__(self, store, sn, months, mode):
+        super().__init__()
+        self.store = store
+        self.sn = sn
+        self.months = months
+        self.mode = mode
+
+    def run(self):
+        results = self.store.search_months(self.sn, self.months, self.mode)
+        try:
+            for month, df in results:
+                if self.isInterruptionRequested():
+                    return
+                self.month_found.emit(month, df)
+        finally:
+            results.close()
+
+class HistorySearchWindow(QDialog):
+    def __init__(self, store, sn, months, mode='prefix'):
+        super().__init__()
+        self.months = months
+        self.searched = 0
+        self.model = TableModel(DataFrame(columns=['Month'] + COLUMNS))
         self.initializeUI()
+        self.thread = HistorySearchThread(store, sn, months, mode)
+        self.thread.month_found.connect(self.add_month)
+        self.thread.start()
 
     def initializeUI(self):
         self.setFixedSize(800, 320)
-        self.setWindowTitle("Search item")
+        self.setWindowTitle("Search history")
         self.setUpWindow()
 
     def setUpWindow(self):
@@ -427,6 +822,82 @@ class TakeoutitemWindow(QDialog):
         self.table.setSelectionMode(QAbstractItemView.SelectionMode.ContiguousSelection)
         self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         self.table.setModel(self.model)
+        self.table.hideColumn(1)
+
+        self.status = QLabel("Searching...")
+        close_button = QPushButton("Close")
+        close_button.clicked.connect(lambda: self.close())
+
+        main_box = QVBoxLayout()
+        main_box.addWidget(self.table)
+        main_box.addWidget(self.status)
+        main_box.addWidget(close_button)
+
+        self.setLayout(main_box)
+
+    def add_month(self, month, df):
+        self.searched += 1
+        df.insert(0, 'Month', month.strftime('%Y-%m'))
+        self.model.appendRows(df)
+        self.status.setText(f"Searched {self.searched}/{len(self.months)} months, {self.model.rowCount()} items found.")
+
+    def done(self, result):
+        self.thread.requestInterruption()
+        self.thread.wait()
+        super().done(result)
+
+class TakeoutitemWindow(QDialog):
+    # Reads the main window's month view, allocator and index each time:
+    # the change feed keeps replacing them while the dialog is open.
+    def __init__(self, main_window, sn=None, date=None, mode='prefix'):
+        super().__init__()
+        self.main_window = main_window
+        self.date = date
+        self.model = PagedTableModel(self.select(sn, mode))
+        self.initializeUI(sn, mode)
+
+    def select(self, sn, mode):
+        # One selection from the month view by the serial index; the model
+        # only formats the rows it shows.
+        with instrument.span('TakeoutitemWindow.search', mode=mode) as info:
+            df = self.main_window.dataframe
+            rows = df.loc[self.main_window.serial_index.search(sn, mode)] if sn else df
+            keep = rows['Takeout_Date'].isna() & (rows['Report_Generated'] == True)
+            if self.date:
+                day = datetime(self.date.year, self.date.month, self.date.day)
+                keep &= (rows['Place_Date'] >= day) & (rows['Place_Date'] < day + timedelta(days=1))
+            rows = rows.loc[keep]
+            info['rows'] = rows.shape[0]
+        return rows
+
+    def initializeUI(self, sn, mode):
+        self.setFixedSize(800, 320)
+        self.setWindowTitle("Search item")
+        self.setUpWindow(sn, mode)
+
+    def setUpWindow(self, sn, mode):
+        self.table = QTableView()
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.setSelectionMode(QAbstractItemView.SelectionMode.ContiguousSelection)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setModel(self.model)
+
+        # The list follows the search box; typing waits for a short pause
+        # before searching again, Enter searches at once.
+        search_sn_label = QLabel("SN:", self)
+        self.search_sn = QLineEdit(sn or '', self)
+        self.contains_checkbox = QCheckBox("Contains")
+        self.contains_checkbox.setChecked(mode == 'substring')
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(250)
+        self.search_timer.timeout.connect(self.search)
+        self.search_sn.textChanged.connect(lambda: self.search_timer.start())
+        self.search_sn.returnPressed.connect(self.search)
+        self.contains_checkbox.stateChanged.connect(lambda: self.search_timer.start())
+        self.status = QLabel("", self)
+        self.show_count()
 
         close_button = QPushButton("Close")
         close_button.clicked.connect(lambda: self.close())
@@ -434,6 +905,14 @@ class TakeoutitemWindow(QDialog):
         takeout_button.clicked.connect(self.take_out)
         save_button = QPushButton("Save")
         save_button.clicked.connect(self.file_save)
+        # Enter belongs to the search box, not to the first button.
+        for button in (close_button, takeout_button, save_button):
+            button.setAutoDefault(False)
+
+        search_box = QHBoxLayout()
+        search_box.addWidget(search_sn_label)
+        search_box.addWidget(self.search_sn)
+        search_box.addWidget(self.contains_checkbox)
 
         button_box = QHBoxLayout()
         button_box.addWidget(takeout_button)
@@ -441,17 +920,39 @@ class TakeoutitemWindow(QDialog):
 
 
         main_box = QVBoxLayout()
+        main_box.addLayout(search_box)
         main_box.addWidget(self.table)
+        main_box.addWidget(self.status)
         main_box.addLayout(button_box)
         main_box.addWidget(save_button)
 
         self.setLayout(main_box)
 
+    def search(self):
+        self.search_timer.stop()
+        mode = 'substring' if self.contains_checkbox.isChecked() else 'prefix'
+        self.model.setDataFrame(self.select(self.search_sn.text() or None, mode))
+        self.show_count()
+
+    def show_count(self):
+        self.status.setText(f"{self.model.total()} items found.")
+
+    @instrument.timed('TakeoutitemWindow.file_save')
     def file_save(self):
-        for _, item in self.model._data.iterrows():
-            self.dataframe.loc[self.dataframe['pid'] == item['pid'], 'Takeout_Date'] = item['Takeout_Date']
-        # self.dataframe.to_excel(f'bin/{self.date.year}{self.date.month:02d}.xlsx', index = False)
-        self.dataframe.to_excel(f'bin/{datetime.now().year}{datetime.now().month:02d}.xlsx', index = False)
+        # Marked rows may come from earlier searches in this window.
+        # Other stations may have deleted or taken out some of them since.
+        main_window = self.main_window
+        df = main_window.dataframe
+        marked = {pid: date for pid, date in self.model.marked.items()
+                  if pid in df.index and isna(df.at[pid, 'Takeout_Date'])}
+        self.model.marked = {}
+        pids = list(marked)
+        df.loc[pids, 'Takeout_Date'] = to_datetime(list(marked.values())).to_numpy()
+        taken_out = df.loc[pids]
+        for pid, serial, box, cell in zip(pids, taken_out['Serial_Number'], taken_out['Box'], taken_out['Cell']):
+            main_window.box_status.release(box, cell)
+            main_window.serial_index.remove(str(serial), pid)
+        main_window.writer.submit('takeout', taken_out)
         QMessageBox.information(
             self,
             'Message',
@@ -471,45 +972,154 @@ class TakeoutitemWindow(QDialog):
 
 
 class TableModel(QAbstractTableModel):
+    # Columns are kept as plain lists next to their display strings, which
+    # are formatted once when a row arrives instead of on every paint.
     def __init__(self, data):
         super(TableModel, self).__init__()
-        self._data = data.copy().reset_index(drop=True)
-        self._data.index += 1
+        self._columns = list(data.columns)
+        self._values, self._display = self._split(data)
+
+    def _split(self, data):
+        values = [data[column].tolist() for column in self._columns]
+        display = [[str(value) for value in column] for column in values]
+        return values, display
 
     def data(self, index, role):
         if role == Qt.ItemDataRole.DisplayRole:
-            value = self._data.iloc[index.row(), index.column()]
-            return str(value)
+            return self._display[index.column()][index.row()]
+
+    def rowCount(self, index=QModelIndex()):
+        return len(self._values[0]) if self._values else 0
+
+    def columnCount(self, index=QModelIndex()):
+        return len(self._columns)
+
+    def column(self, name):
+        return self._values[self._columns.index(name)]
+
+    def to_dataframe(self):
+        return DataFrame(dict(zip(self._columns, self._values)), columns=self._columns)
+
+    @instrument.timed('TableModel.setDataFrame')
+    def setDataFrame(self, data):
+        self.beginResetModel()
+        self._values, self._display = self._split(data)
+        self.endResetModel()
 
-    def rowCount(self, index):
-        return self._data.shape[0]
+    def appendRows(self, data):
+        if data.shape[0] == 0:
+            return
+        first = self.rowCount()
+        values, display = self._split(data)
+        self.beginInsertRows(QModelIndex(), first, first + data.shape[0] - 1)
+        for i in range(len(self._columns)):
+            self._values[i].extend(values[i])
+            self._display[i].extend(display[i])
+        self.endInsertRows()
+
+    def removePids(self, pid):
+        pid = set(pid)
+        rows = [row for row, row_pid in enumerate(self.column('pid')) if row_pid in pid]
+        for first, last in reversed(row_ranges(rows)):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            for column in self._values + self._display:
+                del column[first:last + 1]
+            self.endRemoveRows()
 
-    def columnCount(self, index):
-        return self._data.shape[1]
-    
     def setTakeout_Date(self, pid, value, role=Qt.EditRole):
-        if role == Qt.EditRole:
-            self._data.loc[(self._data['pid'].isin(pid) & self._data['Report_Generated'] == True), 'Takeout_Date'] = value
-        else:
+        if role != Qt.EditRole:
             return False
+        pid = set(pid)
+        report_generated = self.column('Report_Generated')
+        rows = [row for row, row_pid in enumerate(self.column('pid')) if row_pid in pid and report_generated[row] == True]
+        column = self._columns.index('Takeout_Date')
+        for row in rows:
+            self._values[column][row] = value
+            self._display[column][row] = str(value)
+        for first, last in row_ranges(rows):
+            self.dataChanged.emit(self.index(first, column), self.index(last, column))
         return True
 
-
-
     def headerData(self, section, orientation, role):
         if role == Qt.ItemDataRole.DisplayRole:
             if orientation == Qt.Orientation.Horizontal:
-                return str(self._data.columns[section])
+                return str(self._columns[section])
 
             if orientation == Qt.Orientation.Vertical:
-                return str(self._data.index[section])
+                return str(section + 1)
+
+
+class PagedTableModel(TableModel):
+    # Holds a whole selection but formats a page of it at a time; the view
+    # asks for the next page when it is scrolled to the end. Takeout dates
+    # are kept by pid in marked, so they outlast a new selection and show
+    # on rows paged in later.
+    PAGE = 200
+
+    def __init__(self, data):
+        self._rows = data
+        self.marked = {}
+        super(PagedTableModel, self).__init__(data.iloc[:self.PAGE])
+
+    def _split(self, data):
+        values, display = super()._split(data)
+        if self.marked:
+            column = self._columns.index('Takeout_Date')
+            for row, pid in enumerate(values[self._columns.index('pid')]):
+                if pid in self.marked:
+                    values[column][row] = self.marked[pid]
+                    display[column][row] = str(self.marked[pid])
+        return values, display
+
+    def total(self):
+        return self._rows.shape[0]
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.rowCount() < self._rows.shape[0]
+
+    def fetchMore(self, parent=QModelIndex()):
+        first = self.rowCount()
+        self.appendRows(self._rows.iloc[first:first + self.PAGE])
+
+    def setDataFrame(self, data):
+        self._rows = data
+        super().setDataFrame(data.iloc[:self.PAGE])
+
+    def setTakeout_Date(self, pid, value, role=Qt.EditRole):
+        if not super().setTakeout_Date(pid, value, role):
+            return False
+        shown = set(self.column('pid'))
+        self.marked.update((row_pid, value) for row_pid in pid if row_pid in shown)
+        return True
+
+
+def row_ranges(rows):
+    ranges = []
+    for row in sorted(rows):
+        if ranges and ranges[-1][1] == row - 1:
+            ranges[-1][1] = row
+        else:
+            ranges.append([row, row])
+    return ranges
 
 
 if __name__ == '__main__':
     Path('bin').mkdir(exist_ok=True)
-    if not Path(f'bin/{datetime.now().year}{datetime.now().month:02d}.xlsx').exists():
-        init_excel_data()
-    box_amount, cell_amount, empty_string, full_string = load_settings()
+    # Instrumentation first, so the migration and rollover get timed.
+    settings = load_settings()
+    instrument.configure(settings)
+    if settings.service:
+        # The service migrates, rolls over and exports the store it owns.
+        store = client = ServiceClient(settings.service, station=settings.station)
+    else:
+        store = SqliteStore('bin/storage.db')
+        init_excel_data(store)
+        client = None
     app = QApplication(sys.argv)
-    window = MainWindow()
+    writer = StoreWriter(store)
+    try:
+        window = MainWindow(store, writer, settings, client)
+    except (OSError, ServiceError) as e:
+        QMessageBox.critical(None, "Store service", f"Store service at {settings.service}: {e}")
+        sys.exit(1)
     sys.exit(app.exec())
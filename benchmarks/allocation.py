@@ -0,0 +1,118 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# The allocation strategies against each other on one simulated rack. The
+# rack starts fill-full with items scattered at random (a rack that has
+# been in use for a while), then every day brings intake batches and the
+# old stock goes out again to hold the fill. Per strategy and fill this
+# reports the allocation time and how many boxes a pick list touches: one
+# intake batch, one day, or one serial prefix of one day. With --reserve,
+# the first prefix also gets its share of the boxes reserved. Prints JSON.
+#
+#   python benchmarks/allocation.py --fill 0.5 0.8 0.95
+
+ROOT = Path(__file__).resolve().parent.parent
+PREFIXES = ['A', 'B', 'C', 'D']
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Compare the allocation strategies.")
+    parser.add_argument('--strategies', nargs='+', help="default: all of them")
+    parser.add_argument('--fill', type=float, nargs='+', default=[0.5, 0.8, 0.95])
+    parser.add_argument('--boxes', type=int, default=200)
+    parser.add_argument('--cells', type=int, default=500)
+    parser.add_argument('--days', type=int, default=20)
+    parser.add_argument('--batches', type=int, default=10, help="intake batches per day")
+    parser.add_argument('--batch', type=int, default=40, help="average items per batch")
+    parser.add_argument('--reserve', action='store_true', help="also run with boxes reserved for prefix A")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="JSON file to write (default: stdout)")
+    return parser
+
+
+def simulate(strategy, fill, params, reserved=None):
+    import numpy as np
+    from core.allocator import BoxAllocator
+
+    rng = np.random.default_rng(params['seed'])
+    box_status = BoxAllocator(params['boxes'], params['cells'], strategy, reserved)
+    target = int(box_status.size * fill)
+    old = rng.permutation(box_status.size)[:target]
+    box_status.load(old // params['cells'] + 1, old % params['cells'] + 1)
+    old = list(old)
+
+    seconds = []
+    items = 0
+    rejected = 0
+    batches = []
+    days = []
+    prefix_days = []
+    for day in range(params['days']):
+        # Every simulated day is a new day for the day strategy.
+        box_status.today = lambda day=day: day
+        day_boxes = set()
+        prefix_boxes = {}
+        for _ in range(params['batches']):
+            count = int(rng.integers(1, 2 * params['batch']))
+            prefix = PREFIXES[int(rng.integers(len(PREFIXES)))]
+            serials = [f'{prefix}{day:03d}{i:05d}' for i in range(count)]
+            begin = time.perf_counter()
+            positions = box_status.allocate_many(count, serials)
+            seconds.append(time.perf_counter() - begin)
+            items += len(positions)
+            rejected += count - len(positions)
+            boxes = {box for box, _ in positions}
+            if boxes:
+                batches.append(len(boxes))
+            day_boxes |= boxes
+            prefix_boxes.setdefault(prefix, set()).update(boxes)
+            # Stock from before the run goes out, at random, to hold the fill.
+            while box_status.used > target and old:
+                position = int(old.pop())
+                box_status.release(position // params['cells'] + 1, position % params['cells'] + 1)
+        days.append(len(day_boxes))
+        prefix_days.extend(len(boxes) for boxes in prefix_boxes.values() if boxes)
+    return {
+        'strategy': strategy,
+        'reserved': bool(reserved),
+        'fill': fill,
+        'items': items,
+        'rejected': rejected,
+        'allocate_seconds': sum(seconds),
+        'allocate_p95_ms': float(np.percentile(seconds, 95)) * 1000,
+        'us_per_item': sum(seconds) / items * 1e6 if items else None,
+        'boxes_per_batch': float(np.mean(batches)) if batches else None,
+        'boxes_per_day': float(np.mean(days)),
+        'boxes_per_prefix_day': float(np.mean(prefix_days)) if prefix_days else None,
+        'fragmentation': round(box_status.fragmentation(), 4),
+    }
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sys.path.insert(0, str(ROOT))
+    from core.allocator import STRATEGIES
+
+    params = {'boxes': args.boxes, 'cells': args.cells, 'days': args.days,
+              'batches': args.batches, 'batch': args.batch, 'seed': args.seed}
+    reservations = [None]
+    if args.reserve:
+        # Prefix A is a quarter of the intake, so it gets a quarter of the boxes.
+        reservations.append({'A': list(range(1, args.boxes // len(PREFIXES) + 1))})
+    runs = [simulate(strategy, fill, params, reserved)
+            for reserved in reservations
+            for fill in args.fill
+            for strategy in args.strategies or STRATEGIES]
+    text = json.dumps({'params': params, 'runs': runs}, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
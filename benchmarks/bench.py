@@ -0,0 +1,351 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Times the app's real code paths against a synthetic warehouse: a settings
+# file plus one legacy bin/YYYYMM.xlsx per month of history, migrated into
+# the store the same way a first start does. Qt runs offscreen.
+#
+#   python benchmarks/bench.py --preset small --output small.json
+#   python benchmarks/bench.py --compare before.json after.json
+
+ROOT = Path(__file__).resolve().parent.parent
+PRESETS = {
+    'small': {'boxes': 40, 'cells': 100, 'rows': 10_000, 'months': 3},
+    'medium': {'boxes': 200, 'cells': 500, 'rows': 100_000, 'months': 6},
+    'large': {'boxes': 500, 'cells': 1000, 'rows': 1_000_000, 'months': 12},
+}
+COLUMNS = ['pid', 'Serial_Number', 'Box', 'Cell', 'Place_Date', 'Report_Generated', 'Takeout_Date']
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the storage app on synthetic data.")
+    parser.add_argument('--preset', choices=PRESETS, default='small')
+    parser.add_argument('--boxes', type=int)
+    parser.add_argument('--cells', type=int)
+    parser.add_argument('--rows', type=int, help="items placed over the whole history")
+    parser.add_argument('--months', type=int, help="months of history, ending with the current one")
+    parser.add_argument('--fill', type=float, default=0.8, help="share of cells still occupied at the end")
+    parser.add_argument('--batch', type=int, default=1000, help="items per add/takeout/save step")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', help="build the data in this folder and keep it")
+    parser.add_argument('--output', help="JSON file to write (default: stdout)")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="compare two result files and exit")
+    return parser
+
+
+def month_starts(count, end=None):
+    month = (end or datetime.now()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    months = [month]
+    while len(months) < count:
+        month = (month - timedelta(days=1)).replace(day=1)
+        months.append(month)
+    return months[::-1]
+
+
+def synthetic_history(boxes, cells, rows, months, fill, seed):
+    # Items are placed evenly over the months. Everything except the last
+    # boxes*cells*fill items is taken out again, so the rack never holds
+    # more than fits and ends up fill-full.
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    starts = month_starts(months)
+    now = datetime.now().replace(microsecond=0)
+    span = (now - starts[0]).total_seconds()
+    place = np.sort(rng.uniform(0, span, rows)).astype('int64')
+    open_count = min(rows, int(boxes * cells * fill))
+    taken = np.ones(rows, dtype=bool)
+    taken[rows - open_count:] = False
+    # A taken-out item stays up to a few days, capped at now.
+    stay = rng.integers(3600, 5 * 86400, rows)
+    takeout = np.minimum(place + stay, int(span))
+    positions = rng.permutation(boxes * cells)
+    box = np.empty(rows, dtype='int64')
+    cell = np.empty(rows, dtype='int64')
+    box[~taken] = positions[:open_count] // cells + 1
+    cell[~taken] = positions[:open_count] % cells + 1
+    box[taken] = rng.integers(1, boxes + 1, rows - open_count)
+    cell[taken] = rng.integers(1, cells + 1, rows - open_count)
+    return starts, {
+        'pid': np.arange(1, rows + 1),
+        'Serial_Number': np.array([f'SN{i:08d}' for i in rng.permutation(rows)]),
+        'Box': box,
+        'Cell': cell,
+        'Place_Date': np.datetime64(starts[0], 's') + place.astype('timedelta64[s]'),
+        'Takeout_Date': np.where(taken, takeout, -1),
+        'taken': taken,
+    }
+
+
+def write_months(folder, starts, history):
+    # One workbook per month with every item that was in the rack during it,
+    # which is what the old rollover copied forward.
+    from openpyxl import Workbook
+    import numpy as np
+    base = np.datetime64(starts[0], 's')
+    place = history['Place_Date']
+    takeout = np.where(history['taken'], base + history['Takeout_Date'].astype('timedelta64[s]'), np.datetime64('NaT'))
+    bounds = [np.datetime64(start) for start in starts] + [np.datetime64(datetime.max.replace(microsecond=0))]
+    for start, month, end in zip(starts, bounds, bounds[1:]):
+        visible = np.flatnonzero((place < end) & (np.isnat(takeout) | (takeout >= month)))
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(COLUMNS)
+        if not len(visible):
+            sheet.append([0, 'init', 0, 0, datetime(1970, 1, 1), True, datetime(1970, 1, 1)])
+        for i in visible:
+            sheet.append([int(history['pid'][i]), str(history['Serial_Number'][i]), int(history['Box'][i]),
+                          int(history['Cell'][i]), place[i].astype(datetime), True,
+                          None if np.isnat(takeout[i]) else takeout[i].astype(datetime)])
+        workbook.save(folder / 'bin' / f'{start.year}{start.month:02d}.xlsx')
+
+
+def prepare(folder, params):
+    (folder / 'bin').mkdir(parents=True, exist_ok=True)
+    with open(folder / 'bin' / 'settings.json', 'w') as f:
+        json.dump({'box_amount': params['boxes'], 'cell_amount': params['cells'],
+                   'empty_string': 0, 'full_string': 1}, f, indent=4)
+    starts, history = synthetic_history(params['boxes'], params['cells'], params['rows'],
+                                        params['months'], params['fill'], params['seed'])
+    write_months(folder, starts, history)
+    return starts
+
+
+def measure(repeat, run, setup=None):
+    # run(state) -> rows handled; setup() builds fresh state and is not timed.
+    times = []
+    rows = 0
+    for _ in range(repeat):
+        state = setup() if setup else None
+        gc.collect()
+        begin = time.perf_counter()
+        rows = run(state)
+        times.append(time.perf_counter() - begin)
+    return {'seconds': min(times), 'runs': times, 'rows': rows}
+
+
+def run_benchmarks(folder, params, starts):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    sys.path.insert(0, str(ROOT))
+    os.chdir(folder)
+    from PySide6.QtCore import Qt
+    from PySide6.QtWidgets import QApplication
+
+    import app
+    from core.allocator import initBoxStatus
+    from core.report import write_report
+    from core.search import initSerialIndex
+    from core.settings import load_settings
+    from core.store import SqliteStore, init_excel_data, load_excel_data
+
+    qt_app = QApplication.instance() or QApplication([])
+    # Message boxes would wait for a click.
+    app.QMessageBox.information = lambda *args: None
+    settings = load_settings()
+    repeat = params['repeat']
+    batch = params['batch']
+    results = {}
+
+    def fresh_store():
+        for path in Path('bin').glob('storage.db*'):
+            path.unlink()
+        return SqliteStore('bin/storage.db')
+
+    def migrate(store):
+        init_excel_data(store)
+        count = store.last_pid()
+        store.conn.close()
+        return count
+    # Migration marks the months as imported, so every run starts from an
+    # empty store; the last one is kept for the rest of the benchmarks.
+    results['init_excel_data'] = measure(repeat, migrate, fresh_store)
+    store = SqliteStore('bin/storage.db')
+    init_excel_data(store)
+
+    results['load_excel_data'] = measure(repeat, lambda _: load_excel_data(store).shape[0])
+    df = load_excel_data(store)
+    memory = {'month_rows': df.shape[0], 'month_bytes': int(df.memory_usage(deep=True).sum()),
+              'dtypes': {column: str(dtype) for column, dtype in df.dtypes.items()}}
+    results['initBoxStatus'] = measure(
+        repeat, lambda _: initBoxStatus(df, settings.box_amount, settings.cell_amount).used)
+    results['initSerialIndex'] = measure(repeat, lambda _: len(initSerialIndex(df).keys))
+
+    def allocate(box_status):
+        return len(box_status.allocate_many(batch))
+    results['allocate_many'] = measure(
+        repeat, allocate, lambda: initBoxStatus(df, settings.box_amount, settings.cell_amount))
+
+    def allocate_one(box_status):
+        return sum(box_status.allocate() is not None for _ in range(batch))
+    results['allocate'] = measure(
+        repeat, allocate_one, lambda: initBoxStatus(df, settings.box_amount, settings.cell_amount))
+
+    writer = app.StoreWriter(store)
+    serials = [f'BENCH{i:08d}' for i in range(batch)]
+
+    def free_cells():
+        # Takes out the oldest open items so the next batch fits.
+        now = datetime.now().replace(microsecond=0).strftime('%Y-%m-%d %H:%M:%S')
+        pids = [row[0] for row in store.find_items('')[:batch]]
+        store.write_batch([('takeout', [(now, pid) for pid in pids])])
+
+    def new_window():
+        return app.MainWindow(store, writer, settings)
+
+    def free_window():
+        free_cells()
+        return new_window()
+    results['MainWindow'] = measure(repeat, lambda _: new_window().dataframe.shape[0])
+
+    def insert(window):
+        added, _ = window.insert_items(serials)
+        return len(added)
+    results['insert_items'] = measure(repeat, insert, free_window)
+
+    def save(window):
+        count = int((window.dataframe['Report_Generated'] == False).sum())
+        window.save_data(show_box=False)
+        writer.wait()
+        return count
+
+    def inserted_window():
+        window = free_window()
+        window.insert_items(serials)
+        return window
+    results['save_data'] = measure(repeat, save, inserted_window)
+
+    window = new_window()
+    # Serials are SN + 8 digits, so this prefix matches about 100 items.
+    open_items = window.dataframe.loc[window.dataframe['Takeout_Date'].isna()]
+    prefix = str(open_items['Serial_Number'].iloc[-1])[:-2]
+    results['TakeoutitemWindow_search'] = measure(repeat, lambda _: app.TakeoutitemWindow(window, prefix).model.rowCount())
+    results['TakeoutitemWindow_all'] = measure(repeat, lambda _: app.TakeoutitemWindow(window).model.rowCount())
+
+    # Typing a short prefix into an open search window, up to the first page.
+    search_window = app.TakeoutitemWindow(window)
+
+    def live_search(_):
+        search_window.search_sn.setText(prefix[:3])
+        search_window.search()
+        search_window.search_sn.setText('')
+        search_window.search()
+        return search_window.model.total()
+    results['TakeoutitemWindow.search'] = measure(repeat, live_search)
+
+    def fetch_all(search_window):
+        while search_window.model.canFetchMore():
+            search_window.model.fetchMore()
+        return search_window.model.rowCount()
+    results['PagedTableModel.fetchMore'] = measure(repeat, fetch_all, lambda: app.TakeoutitemWindow(window))
+
+    def takeout(search_window):
+        while search_window.model.rowCount() < batch and search_window.model.canFetchMore():
+            search_window.model.fetchMore()
+        pids = search_window.model.column('pid')[:batch]
+        search_window.model.setTakeout_Date(pids, datetime.now().replace(microsecond=0))
+        search_window.file_save()
+        writer.wait()
+        return len(pids)
+    results['takeout'] = measure(repeat, takeout, lambda: app.TakeoutitemWindow(window))
+
+    model = app.TableModel(window.dataframe)
+    rows = min(model.rowCount(), 10_000)
+    indexes = [model.index(row, column) for row in range(rows) for column in range(model.columnCount())]
+
+    def paint(_):
+        for index in indexes:
+            model.data(index, Qt.ItemDataRole.DisplayRole)
+        return len(indexes)
+    results['TableModel.data'] = measure(repeat, paint)
+    results['TableModel.setDataFrame'] = measure(repeat, lambda _: model.setDataFrame(window.dataframe) or model.rowCount())
+
+    months = starts[::-1]
+    results['search_months'] = measure(
+        repeat, lambda _: sum(df.shape[0] for _, df in store.search_months(prefix, months)))
+    first = starts[0].strftime('%Y-%m-%d')
+    last = datetime.now().strftime('%Y-%m-%d')
+    results['write_report_csv'] = measure(
+        repeat, lambda _: write_report(store, settings, 'report.csv', first, last))
+    results['write_report_xlsx'] = measure(
+        repeat, lambda _: write_report(store, settings, 'report.xlsx', first, last))
+    results['export_month'] = measure(repeat, lambda _: store.export_month() or df.shape[0])
+    qt_app.processEvents()
+    return results, memory
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base_path, new_path):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'benchmark':<28}{'base':>12}{'new':>12}{'ratio':>8}")
+    for name, result in new['results'].items():
+        if name not in base['results']:
+            print(f"{name:<28}{'-':>12}{result['seconds']:>12.4f}")
+            continue
+        before = base['results'][name]['seconds']
+        ratio = result['seconds'] / before if before else float('inf')
+        print(f"{name:<28}{before:>12.4f}{result['seconds']:>12.4f}{ratio:>8.2f}")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return 0
+    params = dict(PRESETS[args.preset])
+    for name in ('boxes', 'cells', 'rows', 'months'):
+        if getattr(args, name) is not None:
+            params[name] = getattr(args, name)
+    params.update(fill=args.fill, batch=args.batch, repeat=args.repeat, seed=args.seed)
+
+    folder = Path(args.keep or tempfile.mkdtemp(prefix='storage-bench-')).resolve()
+    output = Path(args.output).resolve() if args.output else None
+    try:
+        begin = time.perf_counter()
+        starts = prepare(folder, params)
+        generate_seconds = time.perf_counter() - begin
+        results, memory = run_benchmarks(folder, params, starts)
+    finally:
+        os.chdir(ROOT)
+        if not args.keep:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    report = {
+        'version': git_version(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'generate_seconds': generate_seconds,
+        'memory': memory,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        output.write_text(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
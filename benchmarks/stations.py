@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Several stations against one store service: every station scans batches
+# of items, saves them and takes some out again, all at once. Afterwards the
+# store is checked for cells handed out twice and every station's change
+# feed is checked to have seen every item. Each station then leaves a batch
+# unsaved and restarts: a second connection under its name must be refused,
+# the restarted station must reclaim the batch, and saving the reclaimed
+# scans must report them missing. Prints JSON.
+#
+#   python benchmarks/stations.py --stations 1 2 4 8
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run several stations against a store service.")
+    parser.add_argument('--stations', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--rounds', type=int, default=50, help="scan/save rounds per station")
+    parser.add_argument('--batch', type=int, default=10, help="items scanned per round")
+    parser.add_argument('--boxes', type=int, default=200)
+    parser.add_argument('--cells', type=int, default=500)
+    parser.add_argument('--output', help="JSON file to write (default: stdout)")
+    return parser
+
+
+def station(address, name, rounds, batch, since, done, result):
+    from core.service import ServiceClient
+    client = ServiceClient(address, station=name)
+    feed = ServiceClient(address)
+    seen = set()
+    added = 0
+    for i in range(rounds):
+        rows, rejected = client.add([f'{name}-{i:05d}-{j:03d}' for j in range(batch)])
+        client.write_batch([('confirm', [(row[0],) for row in rows])])
+        # Every other round takes out the first item it just saved.
+        if i % 2 and rows:
+            client.write_batch([('takeout', [(None, rows[0][0])])])
+        added += len(rows)
+        changes = feed.changes(since)
+        if changes:
+            since = changes[-1][0]
+            seen.update(pid for _, kind, pid, _ in changes if kind == 'add')
+    # Once every station is done, catch up with what the others did after
+    # our last round.
+    done.wait()
+    changes = feed.changes(since)
+    seen.update(pid for _, kind, pid, _ in changes if kind == 'add')
+    feed.close()
+    result.update(added=added, seen=seen, reclaim_ok=restart(address, name, client, batch))
+
+
+def restart(address, name, client, batch):
+    from core.service import ServiceClient, ServiceError
+    rows, _ = client.add([f'{name}-unsaved-{j:03d}' for j in range(batch)])
+    pids = [row[0] for row in rows]
+    try:
+        ServiceClient(address, station=name).last_change()
+        refused = False
+    except ServiceError:
+        refused = True
+    client.close()
+    # The service lets go of the name once it sees the connection close.
+    restarted = ServiceClient(address, station=name)
+    for _ in range(50):
+        try:
+            reclaimed = restarted.reclaim()
+            break
+        except ServiceError:
+            time.sleep(0.02)
+    else:
+        return False
+    missing = restarted.write_batch([('confirm', [(pid,) for pid in pids])])
+    restarted.close()
+    return refused and reclaimed == len(pids) and sorted(missing) == sorted(pids)
+
+
+def run(folder, stations, params):
+    from core.service import StoreService
+    from core.settings import Settings
+    from core.store import SqliteStore
+
+    for path in Path(folder, 'bin').glob('storage.db*'):
+        path.unlink()
+    store = SqliteStore(Path(folder, 'bin', 'storage.db'))
+    store.rollover()
+    settings = Settings(params['boxes'], params['cells'], '0', '1', False, '', 'next_fit', {}, '')
+    server = StoreService(('127.0.0.1', 0), store, settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    address = server.server_address
+
+    results = [{} for _ in range(stations)]
+    since = store.last_change()
+    done = threading.Barrier(stations)
+    threads = [threading.Thread(target=station, args=(address, f'S{n}', params['rounds'], params['batch'],
+                                                      since, done, results[n]))
+               for n in range(stations)]
+    begin = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - begin
+    server.shutdown()
+    server.server_close()
+
+    with store.lock:
+        collisions = store.conn.execute(
+            'SELECT COUNT(*) FROM (SELECT Box, Cell FROM items WHERE Takeout_Date IS NULL '
+            'GROUP BY Box, Cell HAVING COUNT(*) > 1)').fetchone()[0]
+        pids = {row[0] for row in store.conn.execute('SELECT pid FROM items')}
+    store.conn.close()
+    added = sum(result['added'] for result in results)
+    return {
+        'stations': stations,
+        'seconds': seconds,
+        'items': added,
+        'items_per_second': added / seconds if seconds else None,
+        'cell_collisions': collisions,
+        'feeds_complete': all(result['seen'] >= pids for result in results),
+        'reclaim_ok': all(result['reclaim_ok'] for result in results),
+    }
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sys.path.insert(0, str(ROOT))
+    params = {'rounds': args.rounds, 'batch': args.batch, 'boxes': args.boxes, 'cells': args.cells}
+    folder = tempfile.mkdtemp(prefix='storage-stations-')
+    Path(folder, 'bin').mkdir()
+    os.chdir(folder)
+    try:
+        runs = [run(folder, stations, params) for stations in args.stations]
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(folder, ignore_errors=True)
+    text = json.dumps({'params': params, 'runs': runs}, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+    return 0 if all(run['cell_collisions'] == 0 and run['feeds_complete'] and run['reclaim_ok'] for run in runs) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
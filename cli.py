@@ -0,0 +1,122 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+# Only the standard library is imported up front; the core modules pull in
+# pandas/numpy themselves when a command actually needs them.
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Simple Storage Manage App without the window.")
+    parser.add_argument('--dir', default='.', help="folder that holds bin/ (default: current folder)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help="place items and print their Box and Cell")
+    add.add_argument('serials', nargs='*')
+    add.add_argument('--file', help="CSV/text file, the first column is the Serial Number")
+
+    takeout = commands.add_parser('takeout', help="take out every open item with these Serial Numbers")
+    takeout.add_argument('serials', nargs='+')
+
+    search = commands.add_parser('search', help="list open items by Serial Number")
+    search.add_argument('text')
+    mode = search.add_mutually_exclusive_group()
+    mode.add_argument('--exact', dest='mode', action='store_const', const='exact', default='prefix')
+    mode.add_argument('--contains', dest='mode', action='store_const', const='substring')
+
+    report = commands.add_parser('report', help="export the items placed from one day to another")
+    report.add_argument('date', help="first day, YYYY-MM-DD")
+    report.add_argument('output', help="xlsx or csv file to write")
+    report.add_argument('--to', help="last day, YYYY-MM-DD (default: the first day)")
+
+    commands.add_parser('occupancy', help="print used and free cells per box")
+
+    compact = commands.add_parser('compact', help="list the moves that would empty whole boxes")
+    compact.add_argument('--boxes', type=int, help="empty at most this many boxes")
+    compact.add_argument('--apply', action='store_true', help="make the moves in the store")
+
+    serve = commands.add_parser('serve', help="run the store service that stations connect to")
+    serve.add_argument('address', nargs='?', help="host:port (default: the service setting, or 127.0.0.1:8765)")
+    return parser
+
+
+def print_rows(rows):
+    for row in rows:
+        print('\t'.join('' if value is None else str(value) for value in row))
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    os.chdir(args.dir)
+    Path('bin').mkdir(exist_ok=True)
+
+    from core import instrument
+    from core.settings import load_settings
+    from core.store import SqliteStore, init_excel_data
+    from core.warehouse import Warehouse
+
+    settings = load_settings()
+    instrument.configure(settings)
+    store = SqliteStore('bin/storage.db')
+    init_excel_data(store)
+    warehouse = Warehouse(store, settings)
+
+    if args.command == 'add':
+        from core.search import parse_serials
+        serials = list(args.serials)
+        if args.file:
+            with open(args.file, 'r', encoding='utf-8-sig', newline='') as f:
+                serials += parse_serials(f.read())
+        rows, rejected = warehouse.add(serials)
+        print_rows((row[1], row[2], row[3]) for row in rows)
+        for serial in rejected:
+            print(f"All Box Full: {serial}", file=sys.stderr)
+        return 1 if rejected else 0
+
+    if args.command == 'takeout':
+        rows, missing = warehouse.takeout(args.serials)
+        print_rows((row[1], row[2], row[3]) for row in rows)
+        for serial in missing:
+            print(f"Not found: {serial}", file=sys.stderr)
+        return 1 if missing else 0
+
+    if args.command == 'search':
+        print_rows(warehouse.search(args.text, args.mode))
+        return 0
+
+    if args.command == 'report':
+        from core.report import write_report
+        count = write_report(store, settings, args.output, args.date, args.to)
+        print(f"{count} items written to {args.output}")
+        return 0
+
+    if args.command == 'occupancy':
+        used = warehouse.occupancy()
+        print_rows((box, count, settings.cell_amount - count) for box, count in enumerate(used, start=1))
+        print(f"Total\t{sum(used)}\t{settings.box_amount * settings.cell_amount - sum(used)}")
+        return 0
+
+    if args.command == 'compact':
+        box_status = warehouse.allocator()
+        plan = warehouse.plan_compaction(args.boxes)
+        print_rows(plan)
+        emptied = len({row[2] for row in plan})
+        print(f"{len(plan)} moves empty {emptied} boxes; fragmentation {box_status.fragmentation():.2f}", file=sys.stderr)
+        if args.apply:
+            warehouse.compact(plan)
+        return 0
+
+    if args.command == 'serve':
+        from core.service import DEFAULT_PORT, parse_address, serve
+        address = parse_address(args.address or settings.service or DEFAULT_PORT)
+        print(f"Store service on {address[0]}:{address[1]}", file=sys.stderr)
+        try:
+            serve(store, settings, address)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,343 @@
+from datetime import date
+
+from core.instrument import timed
+
+# numpy is imported inside the methods that need it, so importing this
+# module stays cheap for the command line tools.
+#
+# Where new items go is up to the allocation strategy ("allocation" in
+# bin/settings.json, see STRATEGIES at the end). Boxes can also be
+# reserved for serial number prefixes ("reserved_boxes"): items with the
+# prefix go to those boxes first and other items stay out of them.
+
+
+class BoxAllocator:
+    # Occupancy bitmap for every cell of the rack, one byte per cell.
+    def __init__(self, box_amount, cell_amount, strategy='next_fit', reserved=None):
+        if strategy not in STRATEGIES:
+            raise ValueError(f'Unknown allocation strategy: {strategy}')
+        self.box_amount = box_amount
+        self.cell_amount = cell_amount
+        self.size = box_amount * cell_amount
+        self.cells = bytearray(self.size)
+        # Used cells per box, kept current so capacity questions need no scan.
+        self.box_used = [0] * box_amount
+        self.used = 0
+        self.last = -1
+        self.first_free = 0
+        self.strategy = STRATEGIES[strategy]
+        # Where the day strategy continues, per reservation: (day, position).
+        self.cursors = {}
+        self.today = date.today
+        self.reserved = {}
+        self.general = None
+        if reserved:
+            self._reserve(reserved)
+
+    def load(self, boxes, cells):
+        from numpy import asarray, frombuffer, int64, uint8
+        positions = (asarray(boxes, dtype=int64) - 1) * self.cell_amount + (asarray(cells, dtype=int64) - 1)
+        positions = positions[(positions >= 0) & (positions < self.size)]
+        frombuffer(self.cells, dtype=uint8)[positions] = 1
+        self.box_used = self.matrix().sum(axis=1).tolist()
+        self.used = self.size - self.cells.count(0)
+        self.last = self.cells.rfind(1)
+        self.first_free = self._next_free(0)
+
+    def is_full(self):
+        return self.used == self.size
+
+    def allocate(self, serial=None):
+        if self.strategy is not next_fit or self.reserved:
+            positions = self.allocate_many(1, None if serial is None else [serial])
+            return positions[0] if positions else None
+        if self.is_full():
+            return None
+        if self.last < self.size - 1:
+            i = self.last + 1
+        else:
+            i = self.first_free
+        self._occupy(i)
+        return self._box_cell(i)
+
+    @timed('allocate_many', rows=len)
+    def allocate_many(self, count, serials=None):
+        # Cells for count new items, in order. With reserved boxes the
+        # serials decide where each item may go; the result then covers the
+        # serials up to the first one that found no cell.
+        if serials is not None:
+            count = len(serials)
+        count = min(count, self.size - self.used)
+        if count <= 0:
+            return []
+        if not self.reserved:
+            return [self._box_cell(int(i)) for i in self._place(count, None, None)]
+        groups = {}
+        for i, serial in enumerate((serials or [''] * count)[:count]):
+            prefix = next((prefix for prefix in self.reserved if str(serial).startswith(prefix)), None)
+            groups.setdefault(prefix, []).append(i)
+        placed = [None] * count
+        for prefix, indices in groups.items():
+            positions = list(self._place(len(indices), self.reserved.get(prefix, self.general), prefix))
+            if prefix is not None and len(positions) < len(indices):
+                # Reserved boxes are full; the rest go with everything else.
+                positions += list(self._place(len(indices) - len(positions), self.general, None))
+            for i, position in zip(indices, positions):
+                placed[i] = int(position)
+        cut = placed.index(None) if None in placed else count
+        for position in placed[cut:]:
+            if position is not None:
+                self.release(*self._box_cell(position))
+        return [self._box_cell(position) for position in placed[:cut]]
+
+    def occupy(self, box, cell):
+        self._occupy(self._position(box, cell))
+
+    def release(self, box, cell):
+        i = self._position(box, cell)
+        if not self.cells[i]:
+            return
+        self.cells[i] = 0
+        self.box_used[i // self.cell_amount] -= 1
+        self.used -= 1
+        if i < self.first_free:
+            self.first_free = i
+        if i == self.last:
+            self.last = self.cells.rfind(1, 0, i)
+
+    def move(self, source, target):
+        self.release(*source)
+        self.occupy(*target)
+
+    def matrix(self):
+        # box_amount x cell_amount uint8 view of the same memory; writes to
+        # it bypass the counters, so treat it as read-only.
+        from numpy import frombuffer, uint8
+        return frombuffer(self.cells, dtype=uint8).reshape(self.box_amount, self.cell_amount)
+
+    def free_cell(self, box):
+        # First free cell of a box, or None when it is full.
+        start = (int(box) - 1) * self.cell_amount
+        i = self.cells.find(0, start, start + self.cell_amount)
+        return None if i == -1 else i - start + 1
+
+    def box_stats(self):
+        # Per box, as arrays indexed by box - 1: used cells, free cells and
+        # the number of separate runs of free cells.
+        from numpy import asarray
+        matrix = self.matrix()
+        used = asarray(self.box_used)
+        runs = (matrix[:, 0] == 0).astype(int) + ((matrix[:, :-1] == 1) & (matrix[:, 1:] == 0)).sum(axis=1)
+        return {'used': used, 'free': self.cell_amount - used, 'free_runs': runs}
+
+    def fragmentation(self):
+        # Share of the free cells that sit in boxes which are partly used,
+        # i.e. that cannot be handed out as a whole empty box.
+        free = self.size - self.used
+        if not free:
+            return 0.0
+        empty_boxes = self.box_used.count(0)
+        return (free - empty_boxes * self.cell_amount) / free
+
+    def plan_compaction(self, max_boxes=None):
+        # Moves that empty as many partly used boxes as possible (at most
+        # max_boxes) with the fewest moves: k boxes can be emptied whenever
+        # the free cells cover k whole boxes, and the k least used ones need
+        # the fewest moves. Items go to the fullest remaining boxes first,
+        # never into boxes that are already empty. Reserved boxes are
+        # compacted among themselves, per prefix, and the rest apart.
+        # Returns [((from_box, from_cell), (to_box, to_cell)), ...].
+        groups = list(self.reserved.values()) + [self.general] if self.reserved else [None]
+        moves = []
+        for boxes in groups:
+            limit = None if max_boxes is None else max_boxes - len({source[0] for source, _ in moves})
+            if limit is not None and limit <= 0:
+                break
+            moves += self._plan_group(boxes, limit)
+        return moves
+
+    def _plan_group(self, boxes, max_boxes):
+        from numpy import argsort, asarray, flatnonzero, ones
+        used = asarray(self.box_used)
+        if boxes is None:
+            boxes = ones(self.box_amount, dtype=bool)
+        empty_boxes = int(((used == 0) & boxes).sum())
+        partial = flatnonzero((used > 0) & (used < self.cell_amount) & boxes)
+        free = int((self.cell_amount - used[boxes]).sum())
+        count = min(free // self.cell_amount - empty_boxes, len(partial))
+        if max_boxes is not None:
+            count = min(count, max_boxes)
+        if count <= 0:
+            return []
+        order = partial[argsort(used[partial], kind='stable')]
+        emptied, kept = order[:count], order[count:][::-1]
+        matrix = self.matrix()
+        sources = flatnonzero(matrix[emptied] == 1)
+        targets = flatnonzero(matrix[kept] == 0)[:len(sources)]
+        return [((int(emptied[s // self.cell_amount]) + 1, int(s % self.cell_amount) + 1),
+                 (int(kept[t // self.cell_amount]) + 1, int(t % self.cell_amount) + 1))
+                for s, t in zip(sources, targets)]
+
+    def _reserve(self, reserved):
+        # {prefix: [box, ...]} into box masks; longer prefixes match first.
+        from numpy import ones, zeros
+        self.general = ones(self.box_amount, dtype=bool)
+        for prefix in sorted(reserved, key=len, reverse=True):
+            boxes = zeros(self.box_amount, dtype=bool)
+            for box in reserved[prefix]:
+                if not 1 <= int(box) <= self.box_amount:
+                    raise ValueError(f'Reserved box {box} for {prefix!r} is not in the rack')
+                boxes[int(box) - 1] = True
+            self.reserved[prefix] = boxes
+            self.general &= ~boxes
+
+    def _place(self, count, boxes, group):
+        # Lets the strategy pick up to count free cells (in boxes, a bool
+        # mask, or anywhere) and marks them used.
+        from numpy import bincount, flatnonzero, frombuffer, uint8
+        positions = self.strategy(self, count, boxes, group)
+        if not len(positions):
+            return positions
+        frombuffer(self.cells, dtype=uint8)[positions] = 1
+        added = bincount(positions // self.cell_amount, minlength=self.box_amount)
+        for box in flatnonzero(added):
+            self.box_used[box] += int(added[box])
+        self.used += len(positions)
+        self.last = max(self.last, int(positions.max()))
+        self.first_free = self._next_free(self.first_free)
+        return positions
+
+    def _free(self, start=0, stop=None, boxes=None):
+        # Free cell positions in [start, stop), only in boxes if given.
+        from numpy import flatnonzero, frombuffer, repeat, uint8
+        stop = self.size if stop is None else stop
+        free = frombuffer(self.cells, dtype=uint8)[start:stop] == 0
+        if boxes is not None:
+            free &= repeat(boxes, self.cell_amount)[start:stop]
+        return flatnonzero(free) + start
+
+    def _runs(self, boxes=None):
+        # Runs of free cells, never crossing a box: (starts, lengths).
+        from numpy import diff, flatnonzero, int8, ones
+        padded = ones((self.box_amount, self.cell_amount + 2), dtype=int8)
+        padded[:, 1:-1] = self.matrix()
+        if boxes is not None:
+            padded[~boxes] = 1
+        edges = diff(padded, axis=1)
+        starts = flatnonzero(edges == -1)
+        ends = flatnonzero(edges == 1)
+        width = self.cell_amount + 1
+        return starts // width * self.cell_amount + starts % width, ends - starts
+
+    def _occupy(self, i):
+        if self.cells[i]:
+            return
+        self.cells[i] = 1
+        self.box_used[i // self.cell_amount] += 1
+        self.used += 1
+        if i > self.last:
+            self.last = i
+        if i == self.first_free:
+            self.first_free = self._next_free(i)
+
+    def _next_free(self, start):
+        i = self.cells.find(0, start)
+        return self.size if i == -1 else i
+
+    def _position(self, box, cell):
+        return (int(box) - 1) * self.cell_amount + (int(cell) - 1)
+
+    def _box_cell(self, i):
+        return i // self.cell_amount + 1, i % self.cell_amount + 1
+
+
+# Strategies get (allocator, count, boxes, group) and return up to count
+# free cell positions as a numpy array, without marking them; boxes is a
+# bool mask of the boxes they may use (None: all), group the reserved
+# prefix being placed (None for everything else).
+
+def next_fit(allocator, count, boxes, group):
+    # The old behavior: fill after the last used cell, and once the last
+    # cell is used, wrap to the first hole.
+    from numpy import concatenate
+    tail = allocator._free(allocator.last + 1, None, boxes)[:count]
+    holes = allocator._free(0, allocator.last + 1, boxes)[:count - len(tail)]
+    return concatenate([tail, holes])
+
+def first_fit(allocator, count, boxes, group):
+    # Holes from the start of the rack first.
+    return allocator._free(allocator.first_free, None, boxes)[:count]
+
+def best_fit(allocator, count, boxes, group):
+    # The batch goes to the fullest box it still fits in; a batch that fits
+    # nowhere fills the emptiest boxes in turn, so it spans as few boxes
+    # as possible.
+    from numpy import argmax, argmin, asarray, concatenate, flatnonzero, int64
+    free = allocator.cell_amount - asarray(allocator.box_used)
+    if boxes is not None:
+        free[~boxes] = 0
+    matrix = allocator.matrix()
+    chosen = []
+    remaining = count
+    while remaining and free.any():
+        fit = flatnonzero(free >= remaining)
+        box = fit[argmin(free[fit])] if len(fit) else argmax(free)
+        take = min(remaining, int(free[box]))
+        chosen.append(flatnonzero(matrix[box] == 0)[:take] + box * allocator.cell_amount)
+        free[box] = 0
+        remaining -= take
+    return concatenate(chosen) if chosen else asarray([], dtype=int64)
+
+def batch(allocator, count, boxes, group):
+    # The batch goes to the shortest run of free cells that holds all of
+    # it, in one box; without one it is placed like best_fit.
+    from numpy import arange, argmin, flatnonzero
+    starts, lengths = allocator._runs(boxes)
+    fits = flatnonzero(lengths >= count)
+    if not len(fits):
+        return best_fit(allocator, count, boxes, group)
+    run = fits[argmin(lengths[fits])]
+    return arange(starts[run], starts[run] + count)
+
+def day(allocator, count, boxes, group):
+    # A day's intake stays together: each batch continues right after the
+    # previous one of the day while that box has room, otherwise it starts
+    # in the longest free run (an empty box, if there is one).
+    from numpy import arange, argmax
+    today = allocator.today()
+    cursor_day, cursor = allocator.cursors.get(group, (None, 0))
+    positions = None
+    box = cursor // allocator.cell_amount
+    if cursor_day == today and cursor % allocator.cell_amount and (boxes is None or boxes[box]):
+        box_end = (box + 1) * allocator.cell_amount
+        run_end = allocator.cells.find(1, cursor, box_end)
+        if (box_end if run_end == -1 else run_end) - cursor >= count:
+            positions = arange(cursor, cursor + count)
+    if positions is None:
+        starts, lengths = allocator._runs(boxes)
+        if not len(starts):
+            return starts
+        run = argmax(lengths)
+        if lengths[run] >= count:
+            positions = arange(starts[run], starts[run] + count)
+        else:
+            positions = best_fit(allocator, count, boxes, group)
+    if len(positions):
+        allocator.cursors[group] = (today, int(positions[-1]) + 1)
+    return positions
+
+STRATEGIES = {
+    'next_fit': next_fit,
+    'first_fit': first_fit,
+    'best_fit': best_fit,
+    'batch': batch,
+    'day': day,
+}
+
+
+@timed('initBoxStatus')
+def initBoxStatus(df, box_amount, cell_amount, strategy='next_fit', reserved=None):
+    df = df.loc[df['Takeout_Date'].isna()]
+    box_status = BoxAllocator(box_amount, cell_amount, strategy, reserved)
+    box_status.load(df['Box'].to_numpy(), df['Cell'].to_numpy())
+    return box_status
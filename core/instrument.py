@@ -0,0 +1,106 @@
+import cProfile
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+
+# Opt-in timing of the slow paths (load, save, allocation, search, report,
+# model refresh). Turned on with "instrument": true in bin/settings.json or
+# STORAGE_INSTRUMENT=1; "profile" also runs cProfile for the whole session.
+# Disabled, a timed call costs one global lookup.
+
+LOG_PATH = 'bin/timing.log'
+PROFILE_PATH = 'bin/profile.pstats'
+
+enabled = False
+logger = logging.getLogger('storage.timing')
+profiler = None
+
+
+def configure(settings):
+    mode = os.environ.get('STORAGE_INSTRUMENT', settings.instrument)
+    if mode in (False, None, '', '0', 'false'):
+        return
+    enable()
+    if mode == 'profile':
+        import atexit
+        toggle_profile()
+        atexit.register(stop_profile)
+
+def enable(path=LOG_PATH, max_bytes=1_000_000, backup_count=3):
+    global enabled
+    if not logger.handlers:
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    enabled = True
+
+def record(name, seconds, **fields):
+    # One JSON object per line: when, what, how long, plus rows/bytes/error.
+    logger.info(json.dumps({'time': datetime.now().isoformat(timespec='milliseconds'),
+                            'name': name, 'seconds': round(seconds, 6), **fields}))
+
+def timed(name=None, rows=None):
+    # rows, if given, turns the return value into a row count.
+    def decorate(func):
+        label = name or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            begin = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                record(label, time.perf_counter() - begin, error=type(e).__name__)
+                raise
+            record(label, time.perf_counter() - begin, **({'rows': rows(result)} if rows else {}))
+            return result
+        return wrapper
+    return decorate
+
+
+class span:
+    # For code that only knows its counts at the end:
+    #     with span('report') as info:
+    #         ...
+    #         info['rows'] = count
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.begin = time.perf_counter() if enabled else None
+        return self.fields
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.begin is not None:
+            if exc_type is not None:
+                self.fields['error'] = exc_type.__name__
+            record(self.name, time.perf_counter() - self.begin, **self.fields)
+
+
+def toggle_profile(path=PROFILE_PATH):
+    # Starts a capture, or stops it and returns where the stats went.
+    # cProfile only sees the thread that started it (the GUI thread).
+    global profiler
+    if profiler is None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return None
+    return stop_profile(path)
+
+def stop_profile(path=PROFILE_PATH):
+    global profiler
+    if profiler is None:
+        return None
+    profiler.disable()
+    profiler.dump_stats(path)
+    profiler = None
+    return path
@@ -0,0 +1,93 @@
+import csv
+import os
+from datetime import datetime, timedelta
+
+from core.instrument import span
+from core.store import COLUMNS
+
+# Reports are read straight from the store: items come from an indexed
+# Place_Date range and are written row by row, and the per-day and per-box
+# figures come from the stats tables the store keeps up to date, so memory
+# use does not grow with the size of the range.
+
+DAILY_COLUMNS = ['Date', 'Intake', 'Takeout']
+BOX_COLUMNS = ['Box', 'Used', 'Free', 'Utilization']
+
+
+def report_bounds(start, end=None):
+    # start and end are dates (or 'YYYY-MM-DD'), end included.
+    start = as_day(start)
+    end = as_day(end) if end else start
+    return start.strftime('%Y-%m-%d'), (end + timedelta(days=1)).strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+def as_day(value):
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d')
+    return value
+
+def box_rows(store, settings):
+    used = store.box_stats()
+    for box in range(1, settings.box_amount + 1):
+        count = used.get(box, 0)
+        yield box, count, settings.cell_amount - count, round(count / settings.cell_amount, 4)
+
+def item_row(row):
+    # Dates stay text in CSV; xlsx gets real datetimes like the old export.
+    pid, sn, box, cell, place_date, report_generated, takeout_date = row
+    return (pid, sn, box, cell, datetime.fromisoformat(place_date), bool(report_generated),
+            datetime.fromisoformat(takeout_date) if takeout_date else None)
+
+def write_report(store, settings, path, start, end=None):
+    # Writes items placed from start to end (inclusive) plus the daily and
+    # box summaries. An .csv path gets three files (path, *_daily.csv and
+    # *_boxes.csv); anything else is written as an xlsx workbook with one
+    # sheet each. Returns the number of items written.
+    first, stop, last = report_bounds(start, end)
+    items = store.iter_placed(first, stop)
+    daily = store.daily_stats(first, last)
+    boxes = box_rows(store, settings)
+    with span('write_report', start=first, end=last) as info:
+        if str(path).lower().endswith('.csv'):
+            count = write_csv(path, items, daily, boxes)
+        else:
+            count = write_xlsx(path, items, daily, boxes)
+        info.update(rows=count, bytes=os.path.getsize(path))
+    return count
+
+def write_csv(path, items, daily, boxes):
+    path = str(path)
+    count = write_csv_sheet(path, COLUMNS, items)
+    write_csv_sheet(path[:-4] + '_daily.csv', DAILY_COLUMNS, daily)
+    write_csv_sheet(path[:-4] + '_boxes.csv', BOX_COLUMNS, boxes)
+    return count
+
+def write_csv_sheet(path, columns, rows):
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+def write_xlsx(path, items, daily, boxes):
+    # write_only keeps just the current row in memory.
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Items')
+    sheet.append(COLUMNS)
+    count = 0
+    for row in items:
+        sheet.append(item_row(row))
+        count += 1
+    sheet = workbook.create_sheet('Daily')
+    sheet.append(DAILY_COLUMNS)
+    for row in daily:
+        sheet.append(row)
+    sheet = workbook.create_sheet('Boxes')
+    sheet.append(BOX_COLUMNS)
+    for row in boxes:
+        sheet.append(row)
+    workbook.save(path)
+    return count
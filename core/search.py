@@ -0,0 +1,71 @@
+import csv
+from bisect import bisect_left, insort
+
+from core.instrument import timed
+from core.store import prefix_end
+
+
+class SerialIndex:
+    # Open items by serial number: a sorted list of (serial, pid) pairs for
+    # prefix lookups and a dict for exact hits. Substring search is a scan
+    # over the distinct serials, so it is only used when asked for.
+    def __init__(self):
+        self.keys = []
+        self.exact = {}
+
+    def load(self, serials, pids):
+        self.keys = sorted(zip(serials, pids))
+        self.exact = {}
+        for serial, pid in self.keys:
+            same_serial = self.exact.get(serial)
+            if same_serial is None:
+                self.exact[serial] = [pid]
+            else:
+                same_serial.append(pid)
+
+    def add(self, serial, pid):
+        insort(self.keys, (serial, pid))
+        self.exact.setdefault(serial, []).append(pid)
+
+    def add_many(self, serials, pids):
+        # Appending and re-sorting is one near-linear merge in timsort.
+        pairs = list(zip(serials, pids))
+        self.keys.extend(pairs)
+        self.keys.sort()
+        for serial, pid in pairs:
+            self.exact.setdefault(serial, []).append(pid)
+
+    def remove(self, serial, pid):
+        i = bisect_left(self.keys, (serial, pid))
+        if i < len(self.keys) and self.keys[i] == (serial, pid):
+            del self.keys[i]
+        pids = self.exact.get(serial)
+        if pids is not None and pid in pids:
+            pids.remove(pid)
+            if not pids:
+                del self.exact[serial]
+
+    @timed('SerialIndex.search', rows=len)
+    def search(self, text, mode='prefix'):
+        if mode == 'exact':
+            return sorted(self.exact.get(text, ()))
+        if mode == 'substring':
+            return sorted(pid for serial, pids in self.exact.items() if text in serial for pid in pids)
+        start = bisect_left(self.keys, (text,))
+        end = bisect_left(self.keys, (prefix_end(text),)) if text else len(self.keys)
+        return sorted(pid for _, pid in self.keys[start:end])
+
+
+@timed('initSerialIndex')
+def initSerialIndex(df):
+    df = df.loc[df['Takeout_Date'].isna()]
+    serial_index = SerialIndex()
+    serial_index.load(df['Serial_Number'].astype(str).tolist(), df['pid'].tolist())
+    return serial_index
+
+def parse_serials(text):
+    # First column of every non-empty CSV/text line; a Serial_Number header is skipped.
+    serials = [row[0].strip() for row in csv.reader(text.splitlines()) if row and row[0].strip()]
+    if serials and serials[0] == 'Serial_Number':
+        serials = serials[1:]
+    return serials
@@ -0,0 +1,412 @@
+import json
+import logging
+import queue
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime
+
+from core.instrument import span
+from core.store import COLUMNS, compact_frame, db_date
+from core.warehouse import Warehouse
+
+# A small local process that owns the store and the allocator, so several
+# stations can scan into the same rack without handing out the same cell.
+# Stations connect over localhost TCP and send one JSON object per line;
+# every request gets one JSON line back:
+#
+#   {"op": "hello", "station": name}           -> {"station": name}   (refused while name is connected)
+#   {"op": "add", "serials": [...]}            -> {"rows": [...], "rejected": [...]}
+#   {"op": "reclaim"}                          -> {"count": n}   (drops this station's unsaved scans)
+#   {"op": "batch", "batch": [[kind, rows]]}   -> {"count": n, "missing": [pid, ...]}
+#   {"op": "changes", "since": seq, "wait": s} -> {"changes": [...], "seq": n} or {"reset": true, ...}
+#   {"op": "search", "text": ..., "mode": ...} -> {"rows": [...]}
+#   {"op": "month", "date": d, "text": ..., "mode": ...} -> {"rows": [...]}
+#   {"op": "placed", "start": d, "end": d, "after": [date, pid]} -> {"rows": [...]}
+#   {"op": "daily", "start": d, "end": d}      -> {"rows": [...]}
+#   {"op": "boxes"} / {"op": "last_pid"}       -> {"rows": [[box, n]...]} / {"pid": n}
+#
+# The read ops are what the window and its reports need, so a station
+# needs nothing but the service address. Writes from all stations are
+# queued and committed together, one transaction per round. That keeps
+# them from fighting over the store file, but the rounds still run one
+# after the other: more stations share the same throughput rather than
+# adding to it.
+
+DEFAULT_PORT = 8765
+# How long a failed month rollover (usually the workbook open in Excel)
+# waits before the next try.
+ROLLOVER_RETRY = 60
+
+logger = logging.getLogger('storage.service')
+
+
+def parse_address(text):
+    # 'host:port', ':port' or 'port'
+    host, _, port = str(text).rpartition(':')
+    return host or '127.0.0.1', int(port or DEFAULT_PORT)
+
+
+class ServiceError(Exception):
+    pass
+
+
+class StoreService(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, store, settings):
+        super().__init__(address, ServiceHandler)
+        self.store = store
+        self.warehouse = Warehouse(store, settings)
+        self.box_status = self.warehouse.allocator()
+        self.next_pid = store.last_pid() + 1
+        self.pending = queue.Queue()
+        self.changed = threading.Condition()
+        # Set when a round failed and the allocator may no longer match
+        # the store; the next round starts from the store again.
+        self.stale = False
+        self.rollover_retry = 0
+        # Station name -> the connection that said hello with it.
+        self.stations = {}
+        self.stations_lock = threading.Lock()
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def submit(self, kind, payload):
+        # Called from the connection threads; waits for the write round.
+        request = {'kind': kind, 'payload': payload, 'done': threading.Event()}
+        self.pending.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise ServiceError(request['error'])
+        return request['result']
+
+    def join(self, handler, station):
+        # One live connection per station name, so a second window with the
+        # same name cannot reclaim the scans of the first.
+        with self.stations_lock:
+            if self.stations.get(station, handler) is not handler:
+                raise ServiceError(f'Station {station!r} is already connected to the store service')
+            if self.stations.get(handler.station) is handler:
+                del self.stations[handler.station]
+            self.stations[station] = handler
+            handler.station = station
+
+    def leave(self, handler):
+        with self.stations_lock:
+            if handler.station is not None and self.stations.get(handler.station) is handler:
+                del self.stations[handler.station]
+            handler.station = None
+
+    def server_close(self):
+        super().server_close()
+        self.pending.put(None)
+        self.writer.join()
+
+    def write_loop(self):
+        # None in the queue stops the loop.
+        while True:
+            try:
+                requests = [self.pending.get(timeout=60)]
+            except queue.Empty:
+                self.rollover()
+                continue
+            while requests[-1] is not None:
+                try:
+                    requests.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            stop = requests[-1] is None
+            if stop:
+                requests.pop()
+            if requests:
+                self.write_round(requests)
+            if stop:
+                return
+
+    def rollover(self):
+        # A month that cannot be closed yet is logged and tried again later;
+        # the writes go on meanwhile.
+        if time.monotonic() < self.rollover_retry:
+            return
+        try:
+            self.store.rollover()
+        except Exception:
+            logger.exception('Month rollover failed, retrying in %s s', ROLLOVER_RETRY)
+            self.rollover_retry = time.monotonic() + ROLLOVER_RETRY
+
+    def write_round(self, requests):
+        # Whatever goes wrong, every request gets an answer and the loop
+        # lives on for the next round.
+        try:
+            self.write_requests(requests)
+        except Exception as e:
+            logger.exception('Write round failed')
+            self.stale = True
+            for request in requests:
+                request.setdefault('error', f'{type(e).__name__}: {e}')
+        finally:
+            for request in requests:
+                request['done'].set()
+            with self.changed:
+                self.changed.notify_all()
+
+    def write_requests(self, requests):
+        # Someone wrote past the service (the command line, an older
+        # station), or the last round failed half way; start from what the
+        # store holds.
+        if self.stale or self.store.changed_externally():
+            self.box_status = self.warehouse.allocator()
+            self.next_pid = max(self.next_pid, self.store.last_pid() + 1)
+            self.stale = False
+        self.rollover()
+        now = db_date(datetime.now().replace(microsecond=0))
+        batch = []
+        for request in requests:
+            try:
+                entries, request['result'] = self.prepare(request['kind'], request['payload'], now)
+                batch.extend(entries)
+            except (KeyError, TypeError, ValueError) as e:
+                request['error'] = f'Bad request: {e}'
+        with span('service.write_round', requests=len(requests), rows=sum(len(rows) for _, rows in batch)):
+            self.store.write_batch(batch)
+
+    def prepare(self, kind, payload, now):
+        # Returns (batch entries, result) and updates the allocator to match.
+        if kind == 'add':
+            serials = [str(serial) for serial in payload['serials']]
+            positions = self.box_status.allocate_many(len(serials), serials)
+            confirmed = int(bool(payload.get('confirm', False)))
+            rows = [(self.next_pid + i, serial, box, cell, now, confirmed, None)
+                    for i, (serial, (box, cell)) in enumerate(zip(serials, positions))]
+            self.next_pid += len(rows)
+            entries = [('add', rows)]
+            if not confirmed and payload.get('station'):
+                entries.append(('pending', [(row[0], str(payload['station'])) for row in rows]))
+            return entries, {'rows': rows, 'rejected': serials[len(positions):]}
+        if kind == 'reclaim':
+            # A station starting up has no unsaved scans; anything still
+            # pending for it was left by a crash and gives its cells back.
+            items = self.store.pending_items(str(payload['station']))
+            for item in items:
+                self.box_status.release(item[2], item[3])
+            return [('delete', [(item[0],) for item in items])], {'count': len(items)}
+        kinds = {entry_kind for entry_kind, _ in payload['batch']}
+        if not kinds <= {'confirm', 'takeout', 'delete'}:
+            raise ValueError(f'unknown batch kind in {sorted(kinds)}')
+        entries = []
+        count = 0
+        missing = []
+        for entry_kind, rows in payload['batch']:
+            if entry_kind == 'confirm':
+                # A scan reclaimed or deleted meanwhile cannot be saved; the
+                # station gets its pid back and scans it again.
+                pids = [int(row[0]) for row in rows]
+                found = {item[0] for item in self.store.items(pids)}
+                missing.extend(pid for pid in pids if pid not in found)
+                entries.append(('confirm', [(pid,) for pid in pids if pid in found]))
+            elif entry_kind in ('takeout', 'delete'):
+                pids = [int(row[-1]) for row in rows]
+                items = {item[0]: item for item in self.store.items(pids)}
+                if entry_kind == 'delete':
+                    pids = [pid for pid in pids if pid in items and not items[pid][5]]
+                    entries.append(('delete', [(pid,) for pid in pids]))
+                else:
+                    pids = [pid for pid in pids if pid in items and items[pid][6] is None]
+                    dates = {int(row[-1]): row[0] for row in rows}
+                    entries.append(('takeout', [(dates[pid] or now, pid) for pid in pids]))
+                for pid in pids:
+                    self.box_status.release(items[pid][2], items[pid][3])
+            count += len(entries[-1][1])
+        return entries, {'count': count, 'missing': missing}
+
+    def changes(self, since, wait=0):
+        # With wait, holds the answer until a write round commits something
+        # (or wait seconds pass). Writes from outside the service are only
+        # seen when the wait ends.
+        with self.changed:
+            feed = self.store.changes(since)
+            if feed == [] and wait:
+                self.changed.wait(min(float(wait), 30))
+        if feed == [] and wait:
+            feed = self.store.changes(since)
+        if feed is None:
+            return {'reset': True, 'seq': self.store.last_change()}
+        return {'changes': feed, 'seq': feed[-1][0] if feed else since}
+
+
+class ServiceHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.station = None
+        # A station that lost power still holds its name until the
+        # connection is found dead.
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    def handle(self):
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    response = self.dispatch(request)
+                except (ServiceError, KeyError, TypeError, ValueError) as e:
+                    response = {'error': str(e)}
+                self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+        finally:
+            self.server.leave(self)
+
+    def dispatch(self, request):
+        service = self.server
+        op = request['op']
+        if op == 'hello':
+            service.join(self, str(request['station']))
+            return {'station': self.station}
+        if op == 'add':
+            # Unsaved scans are booked to the station of this connection.
+            return service.submit('add', {**request, 'station': self.station})
+        if op == 'batch':
+            return service.submit('batch', request)
+        if op == 'reclaim':
+            if self.station is None:
+                raise ServiceError('reclaim needs a station name')
+            return service.submit('reclaim', {'station': self.station})
+        if op == 'changes':
+            return service.changes(int(request['since']), request.get('wait', 0))
+        if op == 'search':
+            return {'rows': service.store.find_items(request.get('text', ''), request.get('mode', 'prefix'))}
+        if op == 'month':
+            date = datetime.fromisoformat(request['date']) if request.get('date') else None
+            return {'rows': service.store.month_rows(date, request.get('text', ''), request.get('mode', 'prefix'))}
+        if op == 'placed':
+            return {'rows': service.store.placed_page(request['start'], request['end'], request.get('after'),
+                                                      min(int(request.get('limit', 1000)), 10000))}
+        if op == 'daily':
+            return {'rows': service.store.daily_stats(request['start'], request['end'])}
+        if op == 'boxes':
+            return {'rows': list(service.store.box_stats().items())}
+        if op == 'last_pid':
+            return {'pid': service.store.last_pid()}
+        if op == 'ping':
+            return {'seq': service.store.last_change()}
+        raise ValueError(f'unknown op {op}')
+
+
+class ServiceClient:
+    # One connection to a StoreService. write_batch matches SqliteStore's,
+    # so StoreWriter can send a station's saves through the service; it
+    # returns the pids the service no longer had. The read methods match
+    # SqliteStore's too, so the window and its reports can use a client in
+    # place of the store. With a station name,
+    # every connection says hello first, and scans added through it can be
+    # reclaimed by that station later.
+    def __init__(self, address, timeout=60, station=None):
+        self.address = parse_address(address) if isinstance(address, str) else address
+        self.timeout = timeout
+        self.station = station
+        self.lock = threading.Lock()
+        self.sock = None
+
+    def request(self, op, **fields):
+        with self.lock:
+            if self.sock is None:
+                self.connect()
+            response = self.exchange({'op': op, **fields})
+        if 'error' in response:
+            raise ServiceError(response['error'])
+        return response
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        self.reader = self.sock.makefile('rb')
+        if self.station:
+            response = self.exchange({'op': 'hello', 'station': self.station})
+            if 'error' in response:
+                self.close()
+                raise ServiceError(response['error'])
+
+    def exchange(self, message):
+        try:
+            self.sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+            line = self.reader.readline()
+        except OSError:
+            self.close()
+            raise
+        if not line:
+            self.close()
+            raise ConnectionError('Store service closed the connection')
+        return json.loads(line)
+
+    def close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+            self.sock = None
+
+    def add(self, serials, confirm=False):
+        response = self.request('add', serials=list(serials), confirm=confirm)
+        return [tuple(row) for row in response['rows']], response['rejected']
+
+    def write_batch(self, batch):
+        return self.request('batch', batch=batch)['missing']
+
+    def reclaim(self):
+        return self.request('reclaim')['count'] if self.station else 0
+
+    def changes(self, since, wait=0):
+        # Same shape as SqliteStore.changes.
+        response = self.request('changes', since=since, wait=wait)
+        if response.get('reset'):
+            return None
+        return [(seq, kind, pid, tuple(item) if item else None) for seq, kind, pid, item in response['changes']]
+
+    def last_change(self):
+        return self.request('ping')['seq']
+
+    def search(self, text, mode='prefix'):
+        return [tuple(row) for row in self.request('search', text=text, mode=mode)['rows']]
+
+    def load_month(self, date=None, text='', mode='prefix'):
+        from pandas import DataFrame
+        rows = self.request('month', date=db_date(date), text=text, mode=mode)['rows']
+        return compact_frame(DataFrame(rows, columns=COLUMNS))
+
+    def search_months(self, text, months, mode='prefix'):
+        # Runs on a worker thread, so it gets a connection of its own rather
+        # than holding up the window's requests.
+        client = ServiceClient(self.address, self.timeout)
+        try:
+            for month in months:
+                yield month, client.load_month(month, text or '', mode)
+        finally:
+            client.close()
+
+    def iter_placed(self, start, end):
+        after = None
+        while True:
+            rows = self.request('placed', start=start, end=end, after=after)['rows']
+            if not rows:
+                break
+            yield from (tuple(row) for row in rows)
+            after = [rows[-1][4], rows[-1][0]]
+
+    def daily_stats(self, start, end):
+        return [tuple(row) for row in self.request('daily', start=start, end=end)['rows']]
+
+    def box_stats(self):
+        return {box: count for box, count in self.request('boxes')['rows']}
+
+    def last_pid(self):
+        return self.request('last_pid')['pid']
+
+
+def serve(store, settings, address):
+    server = StoreService(parse_address(address) if isinstance(address, str) else address, store, settings)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        store.export_month()
@@ -0,0 +1,28 @@
+import json
+import os
+import socket
+from collections import namedtuple
+
+Settings = namedtuple('Settings', ['box_amount', 'cell_amount', 'empty_string', 'full_string', 'instrument', 'service',
+                                   'allocation', 'reserved_boxes', 'station'])
+
+
+def load_settings(path='bin/settings.json'):
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return Settings(
+        box_amount=data['box_amount'],
+        cell_amount=data['cell_amount'],
+        empty_string=str(data['empty_string']),
+        full_string=str(data['full_string']),
+        instrument=data.get('instrument', False),
+        # 'host:port' of a running store service; empty means use bin/storage.db directly.
+        service=os.environ.get('STORAGE_SERVICE', data.get('service', '')),
+        # Where new items go, see core.allocator.STRATEGIES, and boxes kept
+        # for serial number prefixes: {"ABC": [1, 2]}.
+        allocation=data.get('allocation', 'next_fit'),
+        reserved_boxes=data.get('reserved_boxes', {}),
+        # Name this station goes by at the store service; windows open at
+        # the same time need different names.
+        station=os.environ.get('STORAGE_STATION', data.get('station') or socket.gethostname()),
+    )
@@ -0,0 +1,543 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+from threading import RLock
+
+from core.instrument import span, timed
+
+# pandas is imported inside the functions that build DataFrames, so the
+# command line tools can open the store without paying for it.
+
+COLUMNS = ['pid', 'Serial_Number', 'Box', 'Cell', 'Place_Date', 'Report_Generated', 'Takeout_Date']
+
+# Per-day intake/takeout counts and open items per box, kept current by
+# triggers in the same transaction as the item change. The first run fills
+# them from the existing items.
+STATS_SCHEMA = '''
+    BEGIN;
+    CREATE TABLE daily_stats (
+        day TEXT PRIMARY KEY,
+        intake INTEGER NOT NULL DEFAULT 0,
+        takeout INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE box_stats (
+        Box INTEGER PRIMARY KEY,
+        open_items INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT INTO daily_stats (day, intake)
+        SELECT substr(Place_Date, 1, 10), COUNT(*) FROM items GROUP BY 1;
+    INSERT INTO daily_stats (day, takeout)
+        SELECT substr(Takeout_Date, 1, 10), COUNT(*) FROM items WHERE Takeout_Date IS NOT NULL GROUP BY 1
+        ON CONFLICT(day) DO UPDATE SET takeout = excluded.takeout;
+    INSERT INTO box_stats (Box, open_items)
+        SELECT Box, COUNT(*) FROM items WHERE Takeout_Date IS NULL GROUP BY Box;
+    CREATE TRIGGER items_stats_insert AFTER INSERT ON items BEGIN
+        INSERT INTO daily_stats (day, intake) VALUES (substr(NEW.Place_Date, 1, 10), 1)
+            ON CONFLICT(day) DO UPDATE SET intake = intake + 1;
+        INSERT INTO daily_stats (day, takeout)
+            SELECT substr(NEW.Takeout_Date, 1, 10), 1 WHERE NEW.Takeout_Date IS NOT NULL
+            ON CONFLICT(day) DO UPDATE SET takeout = takeout + 1;
+        INSERT INTO box_stats (Box, open_items)
+            SELECT NEW.Box, 1 WHERE NEW.Takeout_Date IS NULL
+            ON CONFLICT(Box) DO UPDATE SET open_items = open_items + 1;
+    END;
+    CREATE TRIGGER items_stats_takeout AFTER UPDATE OF Takeout_Date ON items
+    WHEN OLD.Takeout_Date IS NOT NEW.Takeout_Date BEGIN
+        UPDATE daily_stats SET takeout = takeout - 1
+            WHERE OLD.Takeout_Date IS NOT NULL AND day = substr(OLD.Takeout_Date, 1, 10);
+        INSERT INTO daily_stats (day, takeout)
+            SELECT substr(NEW.Takeout_Date, 1, 10), 1 WHERE NEW.Takeout_Date IS NOT NULL
+            ON CONFLICT(day) DO UPDATE SET takeout = takeout + 1;
+        UPDATE box_stats SET open_items = open_items - 1
+            WHERE OLD.Takeout_Date IS NULL AND Box = OLD.Box;
+        INSERT INTO box_stats (Box, open_items)
+            SELECT NEW.Box, 1 WHERE NEW.Takeout_Date IS NULL
+            ON CONFLICT(Box) DO UPDATE SET open_items = open_items + 1;
+    END;
+    CREATE TRIGGER items_stats_delete AFTER DELETE ON items BEGIN
+        UPDATE daily_stats SET intake = intake - 1 WHERE day = substr(OLD.Place_Date, 1, 10);
+        UPDATE daily_stats SET takeout = takeout - 1
+            WHERE OLD.Takeout_Date IS NOT NULL AND day = substr(OLD.Takeout_Date, 1, 10);
+        UPDATE box_stats SET open_items = open_items - 1
+            WHERE OLD.Takeout_Date IS NULL AND Box = OLD.Box;
+    END;
+    COMMIT;
+'''
+
+MMAP_SIZE = 1 << 30
+
+# Added after the stats tables existed, so created on every open instead.
+MOVE_SCHEMA = '''
+    CREATE TRIGGER IF NOT EXISTS items_stats_move AFTER UPDATE OF Box ON items
+    WHEN OLD.Box IS NOT NEW.Box AND NEW.Takeout_Date IS NULL BEGIN
+        UPDATE box_stats SET open_items = open_items - 1 WHERE Box = OLD.Box;
+        INSERT INTO box_stats (Box, open_items) VALUES (NEW.Box, 1)
+            ON CONFLICT(Box) DO UPDATE SET open_items = open_items + 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS items_changes_move AFTER UPDATE OF Box, Cell ON items
+    WHEN OLD.Box IS NOT NEW.Box OR OLD.Cell IS NOT NEW.Cell BEGIN
+        INSERT INTO changes (pid, kind) VALUES (NEW.pid, 'move');
+    END;
+'''
+
+# Which station scanned each unconfirmed item committed through the store
+# service, so the station can give back what it left unsaved. Rows leave
+# when the item is saved or deleted.
+PENDING_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS pending (
+        pid INTEGER PRIMARY KEY,
+        station TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS pending_station ON pending (station);
+    CREATE TRIGGER IF NOT EXISTS items_pending_confirm AFTER UPDATE OF Report_Generated ON items
+    WHEN NEW.Report_Generated = 1 BEGIN
+        DELETE FROM pending WHERE pid = NEW.pid;
+    END;
+    CREATE TRIGGER IF NOT EXISTS items_pending_delete AFTER DELETE ON items BEGIN
+        DELETE FROM pending WHERE pid = OLD.pid;
+    END;
+'''
+
+
+def month_path(date=None, suffix='xlsx'):
+    date = date or datetime.now()
+    return f'bin/{date.year}{date.month:02d}.{suffix}'
+
+def month_start(date=None):
+    return (date or datetime.now()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def month_bounds(date=None):
+    start = month_start(date)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return db_date(start), db_date(end)
+
+def month_list(start, end=None):
+    # First day of every month from end back to start, newest first.
+    month = month_start(end)
+    start = month_start(start)
+    months = []
+    while month >= start:
+        months.append(month)
+        month = (month - timedelta(days=1)).replace(day=1)
+    return months
+
+def prefix_end(text):
+    # Smallest string greater than every string starting with text.
+    return text[:-1] + chr(ord(text[-1]) + 1)
+
+def db_date(value):
+    # None, NaN and NaT all compare unequal to themselves.
+    if value is None or value != value:
+        return None
+    if not isinstance(value, datetime):
+        from pandas import to_datetime
+        value = to_datetime(value)
+        if value != value:
+            return None
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+def serial_condition(text, mode='prefix'):
+    if not text:
+        return '', ()
+    if mode == 'exact':
+        return 'AND Serial_Number = ?', (text,)
+    if mode == 'substring':
+        return 'AND instr(Serial_Number, ?) > 0', (text,)
+    return 'AND Serial_Number >= ? AND Serial_Number < ?', (text, prefix_end(text))
+
+def batch_rows(kind, df):
+    # Turns a DataFrame into the plain tuples write_batch expects.
+    if kind == 'add':
+        return [(int(row.pid), str(row.Serial_Number), int(row.Box), int(row.Cell), db_date(row.Place_Date),
+                 int(bool(row.Report_Generated)), db_date(row.Takeout_Date))
+                for row in df.itertuples(index=False)]
+    if kind == 'takeout':
+        return [(db_date(row.Takeout_Date), int(row.pid)) for row in df.itertuples(index=False)]
+    if kind in ('confirm', 'delete'):
+        return [(int(pid),) for pid in df['pid']]
+    raise ValueError(f'Unknown batch kind: {kind}')
+
+def chunk(items, n):
+    for i in range(0, len(items), n):
+        yield items[i:i + n]
+
+def item_frame(rows):
+    # DataFrame in the same shape load_month returns, from COLUMNS-ordered tuples.
+    from pandas import DataFrame
+    df = compact_frame(DataFrame(rows, columns=COLUMNS))
+    df.index = df['pid'].to_numpy()
+    return df
+
+def compact_frame(df):
+    # Smallest dtypes that hold the item columns: uint16 Box/Cell, a bool
+    # flag, datetime64 dates with NaT for missing, and Arrow-backed serials
+    # when pyarrow is installed. Every frame the window keeps goes through
+    # here, so concat never falls back to object or int64 columns.
+    from pandas import to_datetime
+    for column in ('Box', 'Cell'):
+        if not len(df) or df[column].max() <= 0xFFFF:
+            df[column] = df[column].astype('uint16')
+    for column in ('Place_Date', 'Takeout_Date'):
+        if df[column].dtype.kind != 'M':
+            df[column] = to_datetime(df[column])
+    df['Report_Generated'] = df['Report_Generated'].astype(bool)
+    serial = serial_dtype()
+    if serial:
+        df['Serial_Number'] = df['Serial_Number'].astype(serial)
+    return df
+
+def serial_dtype():
+    from importlib.util import find_spec
+    return 'string[pyarrow]' if find_spec('pyarrow') else None
+
+def init_row():
+    from pandas import DataFrame, to_datetime
+    return DataFrame({'pid': 0, 'Serial_Number': 'init',  'Box': 0,  'Cell': 0,
+                    'Place_Date': to_datetime("1970-01-01 00:00:00"), 'Report_Generated': True, 'Takeout_Date': to_datetime("1970-01-01 00:00:00")},
+                    index=[0])
+
+def read_month_excel(path):
+    from pandas import read_excel
+    df = read_excel(path,
+                    dtype={
+                        'pid': int,
+                        'Serial_Number': str,
+                        'Box': int,
+                        'Cell': int,
+                        # 'Place_Date': datetime,
+                        'Report_Generated': bool,
+                        # 'Takeout_Date': datetime
+                    }
+                    )
+    df = df.loc[df['Serial_Number'] != "init",].copy().reset_index(drop=True)
+    return df
+
+@timed('load_excel_data', rows=len)
+def load_excel_data(store, date=None):
+    df = store.load_month(date)
+    # Rows are looked up by pid, so pid doubles as the (unnamed) row index.
+    df.index = df['pid'].to_numpy()
+    return df
+
+def init_excel_data(store):
+    store.migrate_excel_files()
+    store.rollover()
+
+
+class SqliteStore:
+    # System of record for every month. The bin/YYYYMM.xlsx files are
+    # imported once and written back only as an export.
+    columns = COLUMNS
+
+    def __init__(self, path):
+        self.path = Path(path)
+        # Shared with the background writer; every use of conn holds lock.
+        self.conn = self.connect(check_same_thread=False)
+        self.lock = RLock()
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=FULL')
+        with self.conn:
+            self.conn.executescript('''
+                CREATE TABLE IF NOT EXISTS items (
+                    pid INTEGER PRIMARY KEY,
+                    Serial_Number TEXT NOT NULL,
+                    Box INTEGER NOT NULL,
+                    Cell INTEGER NOT NULL,
+                    Place_Date TEXT NOT NULL,
+                    Report_Generated INTEGER NOT NULL DEFAULT 0,
+                    Takeout_Date TEXT
+                );
+                CREATE INDEX IF NOT EXISTS items_serial_number ON items (Serial_Number);
+                CREATE INDEX IF NOT EXISTS items_place_date ON items (Place_Date);
+                CREATE INDEX IF NOT EXISTS items_takeout_date ON items (Takeout_Date);
+                CREATE INDEX IF NOT EXISTS items_box_cell ON items (Box, Cell);
+                CREATE TABLE IF NOT EXISTS imported_months (
+                    month TEXT PRIMARY KEY,
+                    imported_at TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                -- Change feed: one row per item change, from any writer.
+                CREATE TABLE IF NOT EXISTS changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    pid INTEGER NOT NULL,
+                    kind TEXT NOT NULL
+                );
+                CREATE TRIGGER IF NOT EXISTS items_changes_insert AFTER INSERT ON items BEGIN
+                    INSERT INTO changes (pid, kind) VALUES (NEW.pid, 'add');
+                END;
+                CREATE TRIGGER IF NOT EXISTS items_changes_takeout AFTER UPDATE OF Takeout_Date ON items
+                WHEN OLD.Takeout_Date IS NOT NEW.Takeout_Date BEGIN
+                    INSERT INTO changes (pid, kind) VALUES (NEW.pid, 'takeout');
+                END;
+                CREATE TRIGGER IF NOT EXISTS items_changes_confirm AFTER UPDATE OF Report_Generated ON items
+                WHEN OLD.Report_Generated IS NOT NEW.Report_Generated BEGIN
+                    INSERT INTO changes (pid, kind) VALUES (NEW.pid, 'confirm');
+                END;
+                CREATE TRIGGER IF NOT EXISTS items_changes_delete AFTER DELETE ON items BEGIN
+                    INSERT INTO changes (pid, kind) VALUES (OLD.pid, 'delete');
+                END;
+            ''')
+        if not self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'daily_stats'").fetchone():
+            self.conn.executescript(STATS_SCHEMA)
+        with self.conn:
+            self.conn.executescript(MOVE_SCHEMA)
+            self.conn.executescript(PENDING_SCHEMA)
+        self.data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def connect(self, **kwargs):
+        # Pages are read through a memory map instead of being copied into
+        # each connection's cache, so searching years of closed months does
+        # not grow the process.
+        conn = sqlite3.connect(self.path, **kwargs)
+        conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+        return conn
+
+    def changed_externally(self):
+        # data_version only moves when another connection commits, so the
+        # window's own writes never trigger a reload.
+        with self.lock:
+            data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        changed = data_version != self.data_version
+        self.data_version = data_version
+        return changed
+
+    def load_month(self, date=None):
+        with self.lock:
+            return self._query_month(self.conn, date)
+
+    def search_months(self, text, months, mode='prefix'):
+        # Uses its own connection so it can run on a worker thread while the
+        # window keeps writing through self.conn.
+        condition, params = serial_condition(text, mode)
+        conn = self.connect()
+        try:
+            for month in months:
+                yield month, self._query_month(conn, month, condition, params)
+        finally:
+            conn.close()
+
+    @timed('store.query_month', rows=len)
+    def _query_month(self, conn, date, condition='', params=()):
+        from pandas import read_sql_query
+        sql, params = self._month_query(date, condition, params)
+        df = read_sql_query(sql, conn, params=params, parse_dates=['Place_Date', 'Takeout_Date'])
+        # Sorting here rather than in SQL keeps SQLite on the index.
+        return compact_frame(df.sort_values('pid', ignore_index=True))
+
+    def _month_query(self, date, condition='', params=()):
+        # Same rows a month workbook used to hold: everything still open at
+        # some point of the month, plus what was placed during it.
+        # Split in two so both halves use the Takeout_Date index: the open
+        # items, and what was taken out since the month began. The cost is
+        # open items plus the month's activity, not the whole history.
+        start, end = month_bounds(date)
+        select = f'SELECT {", ".join(self.columns)} FROM items WHERE Place_Date < ? {condition}'
+        return (f'{select} AND Takeout_Date IS NULL UNION ALL {select} AND Takeout_Date >= ?',
+                (end,) + params + (end,) + params + (start,))
+
+    @timed('store.month_rows', rows=len)
+    def month_rows(self, date=None, text='', mode='prefix'):
+        # load_month/search_months as plain tuples, sorted by pid, for the
+        # store service to send on.
+        sql, params = self._month_query(date, *serial_condition(text, mode))
+        with self.lock:
+            return sorted(self.conn.execute(sql, params).fetchall())
+
+    @timed('store.find_items', rows=len)
+    def find_items(self, text, mode='prefix'):
+        # Open items as plain tuples in COLUMNS order, without pandas.
+        condition, params = serial_condition(text, mode)
+        with self.lock:
+            return self.conn.execute(
+                f'SELECT {", ".join(self.columns)} FROM items '
+                f'WHERE Takeout_Date IS NULL {condition} ORDER BY pid', params).fetchall()
+
+    def iter_placed(self, start, end):
+        # Items placed from start up to (not including) end, both
+        # 'YYYY-MM-DD', streamed in chunks over a separate connection.
+        conn = self.connect()
+        try:
+            cursor = conn.execute(
+                f'SELECT {", ".join(self.columns)} FROM items '
+                'WHERE Place_Date >= ? AND Place_Date < ? ORDER BY Place_Date, pid', (start, end))
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    def placed_page(self, start, end, after=None, limit=1000):
+        # One page of iter_placed; after is the (Place_Date, pid) of the
+        # last row of the page before.
+        after_condition, params = ('AND (Place_Date, pid) > (?, ?) ', tuple(after)) if after else ('', ())
+        with self.lock:
+            return self.conn.execute(
+                f'SELECT {", ".join(self.columns)} FROM items WHERE Place_Date >= ? AND Place_Date < ? '
+                f'{after_condition}ORDER BY Place_Date, pid LIMIT ?', (start, end) + params + (limit,)).fetchall()
+
+    def daily_stats(self, start, end):
+        # (day, intake, takeout) for every day with activity, both ends included.
+        with self.lock:
+            return self.conn.execute(
+                'SELECT day, intake, takeout FROM daily_stats WHERE day >= ? AND day <= ? '
+                'AND (intake > 0 OR takeout > 0) ORDER BY day', (start, end)).fetchall()
+
+    def box_stats(self):
+        with self.lock:
+            return dict(self.conn.execute('SELECT Box, open_items FROM box_stats'))
+
+    def last_change(self):
+        with self.lock:
+            return self.conn.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+
+    def changes(self, since):
+        # (seq, kind, pid, item) for every change after since, with the item
+        # row as it is now, or None once it has been deleted. Returns None if the feed was pruned past
+        # since, in which case the caller has to load the month again.
+        with self.lock:
+            pruned = self.conn.execute("SELECT value FROM meta WHERE key = 'changes_pruned'").fetchone()
+            if pruned and since < int(pruned[0]):
+                return None
+            rows = self.conn.execute(
+                f'SELECT changes.seq, changes.kind, changes.pid, {", ".join(self.columns[1:])} '
+                'FROM changes LEFT JOIN items ON items.pid = changes.pid WHERE changes.seq > ? ORDER BY changes.seq',
+                (since,)).fetchall()
+        return [(row[0], row[1], row[2], row[2:] if row[3] is not None else None) for row in rows]
+
+    def items(self, pids):
+        # Current rows for the given pids, in COLUMNS order.
+        with self.lock:
+            return [row for part in chunk(list(pids), 500) for row in self.conn.execute(
+                f'SELECT {", ".join(self.columns)} FROM items WHERE pid IN ({", ".join("?" * len(part))})',
+                part)]
+
+    def pending_items(self, station):
+        # Unconfirmed items the store service committed for station.
+        with self.lock:
+            return self.conn.execute(
+                f'SELECT {", ".join("items." + column for column in self.columns)} FROM items '
+                'JOIN pending USING (pid) WHERE station = ? AND Report_Generated = 0', (station,)).fetchall()
+
+    def open_cells(self):
+        with self.lock:
+            return self.conn.execute('SELECT Box, Cell FROM items WHERE Takeout_Date IS NULL').fetchall()
+
+    def last_pid(self):
+        with self.lock:
+            return self.conn.execute('SELECT COALESCE(MAX(pid), 0) FROM items').fetchone()[0]
+
+    def add_items(self, df):
+        self.write_batch([('add', batch_rows('add', df))])
+
+    def takeout_items(self, df):
+        self.write_batch([('takeout', batch_rows('takeout', df))])
+
+    def write_batch(self, batch):
+        # Applies a list of ('add' | 'takeout' | 'confirm' | 'delete' | 'move' |
+        # 'pending', rows) in one transaction, with rows shaped as batch_rows
+        # returns them ('move' rows are (box, cell, pid), 'pending' rows
+        # (pid, station)). Only unconfirmed items can be deleted and only
+        # open items moved.
+        with span('store.write_batch', rows=sum(len(rows) for _, rows in batch)), self.lock, self.conn:
+            for kind, rows in batch:
+                if kind == 'add':
+                    self.conn.executemany(
+                        f'INSERT INTO items ({", ".join(self.columns)}) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                elif kind == 'takeout':
+                    self.conn.executemany('UPDATE items SET Takeout_Date = ? WHERE pid = ?', rows)
+                elif kind == 'confirm':
+                    self.conn.executemany('UPDATE items SET Report_Generated = 1 WHERE pid = ?', rows)
+                elif kind == 'delete':
+                    self.conn.executemany('DELETE FROM items WHERE pid = ? AND Report_Generated = 0', rows)
+                elif kind == 'pending':
+                    self.conn.executemany('INSERT OR REPLACE INTO pending (pid, station) VALUES (?, ?)', rows)
+                elif kind == 'move':
+                    self.conn.executemany(
+                        'UPDATE items SET Box = ?, Cell = ? WHERE pid = ? AND Takeout_Date IS NULL', rows)
+                else:
+                    raise ValueError(f'Unknown batch kind: {kind}')
+
+    def export_month(self, date=None):
+        with span('store.export_month') as info:
+            df = self.load_month(date)
+            if df.shape[0] == 0:
+                df = init_row()
+            temp_path = month_path(date, 'tmp.xlsx')
+            df.to_excel(temp_path, index=False)
+            os.replace(temp_path, month_path(date))
+            info.update(rows=df.shape[0], bytes=os.path.getsize(month_path(date)))
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO imported_months VALUES (?, ?)',
+                              (Path(month_path(date)).stem, db_date(datetime.now())))
+
+    @timed('store.rollover')
+    def rollover(self, date=None):
+        # Closes the open month once date has moved past it: its workbook is
+        # exported one last time, then date's month becomes the open one.
+        # Nothing is copied forward; the open items are the indexed
+        # Takeout_Date IS NULL rows and box_stats already holds occupancy.
+        # Returns the closed month, or None.
+        month = month_start(date)
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'open_month'").fetchone()
+        opened = datetime.strptime(row[0], '%Y%m') if row else None
+        if opened is not None and opened >= month:
+            return None
+        if opened is not None:
+            with span('store.rollover.export', month=row[0]):
+                self.export_month(opened)
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('open_month', ?)", (month.strftime('%Y%m'),))
+            self.prune_changes()
+        return opened
+
+    def prune_changes(self, keep=100_000):
+        # Keeps the feed from growing forever; readers further behind reload.
+        with self.lock, self.conn:
+            last = self.conn.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+            if last > keep:
+                self.conn.execute('DELETE FROM changes WHERE seq <= ?', (last - keep,))
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('changes_pruned', ?)", (str(last - keep),))
+
+    @timed('store.migrate_excel_files')
+    def migrate_excel_files(self):
+        imported = {row[0] for row in self.conn.execute('SELECT month FROM imported_months')}
+        paths = sorted(path for path in self.path.parent.glob('??????.xlsx')
+                       if path.stem.isdigit() and path.stem not in imported)
+        if not paths:
+            return
+        # The same item shows up in every month it stayed in the rack, and
+        # pid restarted whenever a month began empty, so rows are matched on
+        # what they describe rather than on pid.
+        keys = {(sn, place, box, cell): pid for pid, sn, box, cell, place in
+                self.conn.execute('SELECT pid, Serial_Number, Box, Cell, Place_Date FROM items')}
+        used_pids = set(keys.values())
+        for path in paths:
+            inserts = []
+            updates = []
+            for row in read_month_excel(path).itertuples(index=False):
+                key = (str(row.Serial_Number), db_date(row.Place_Date), int(row.Box), int(row.Cell))
+                values = (int(bool(row.Report_Generated)), db_date(row.Takeout_Date))
+                if key in keys:
+                    updates.append(values + (keys[key],))
+                    continue
+                pid = int(row.pid)
+                if pid in used_pids:
+                    pid = max(used_pids) + 1
+                used_pids.add(pid)
+                keys[key] = pid
+                inserts.append((pid,) + key + values)
+            with self.lock, self.conn:
+                self.conn.executemany(
+                    'INSERT INTO items (pid, Serial_Number, Place_Date, Box, Cell, Report_Generated, Takeout_Date) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)', inserts)
+                self.conn.executemany(
+                    'UPDATE items SET Report_Generated = ?, Takeout_Date = COALESCE(?, Takeout_Date) WHERE pid = ?',
+                    updates)
+                self.conn.execute('INSERT INTO imported_months VALUES (?, ?)', (path.stem, db_date(datetime.now())))
@@ -0,0 +1,67 @@
+from datetime import datetime
+
+from core.allocator import BoxAllocator
+from core.store import db_date
+
+
+class Warehouse:
+    # Headless counterpart of MainWindow for scripts. Every call reads what
+    # it needs from the store and commits straight away, so there is no
+    # unsaved state and nothing is kept between calls.
+    def __init__(self, store, settings):
+        self.store = store
+        self.settings = settings
+
+    def allocator(self):
+        box_status = BoxAllocator(self.settings.box_amount, self.settings.cell_amount,
+                                  self.settings.allocation, self.settings.reserved_boxes)
+        cells = self.store.open_cells()
+        box_status.load([box for box, _ in cells], [cell for _, cell in cells])
+        return box_status
+
+    def add(self, serials, date=None):
+        # Returns (rows, rejected); rows are in store.columns order.
+        positions = self.allocator().allocate_many(len(serials), serials)
+        added = serials[:len(positions)]
+        first_pid = self.store.last_pid() + 1
+        place_date = db_date(date or datetime.now().replace(microsecond=0))
+        rows = [(first_pid + i, serial, box, cell, place_date, 1, None)
+                for i, (serial, (box, cell)) in enumerate(zip(added, positions))]
+        if rows:
+            self.store.write_batch([('add', rows)])
+        return rows, serials[len(positions):]
+
+    def takeout(self, serials, date=None):
+        # Takes out every open item with one of the serials. Returns
+        # (rows, missing) where missing lists serials with no open item.
+        rows = []
+        missing = []
+        for serial in serials:
+            found = self.store.find_items(serial, 'exact')
+            if not found:
+                missing.append(serial)
+            rows.extend(found)
+        takeout_date = db_date(date or datetime.now().replace(microsecond=0))
+        if rows:
+            self.store.write_batch([('takeout', [(takeout_date, row[0]) for row in rows])])
+        return rows, missing
+
+    def search(self, text, mode='prefix'):
+        return self.store.find_items(text, mode)
+
+    def plan_compaction(self, max_boxes=None):
+        # The allocator's plan with the items that would move:
+        # [(pid, serial, from_box, from_cell, to_box, to_cell), ...]
+        moves = self.allocator().plan_compaction(max_boxes)
+        if not moves:
+            return []
+        items = {(row[2], row[3]): row for row in self.store.find_items('')}
+        return [(items[source][0], items[source][1]) + source + target for source, target in moves]
+
+    def compact(self, plan):
+        if plan:
+            self.store.write_batch([('move', [(to_box, to_cell, pid) for pid, _, _, _, to_box, to_cell in plan])])
+
+    def occupancy(self):
+        used = self.store.box_stats()
+        return [used.get(box, 0) for box in range(1, self.settings.box_amount + 1)]